@@ -1,221 +1,1014 @@
 import os
+import json
+import gzip
+import asyncio
+import hashlib
+import tempfile
 import sqlite3
+from contextlib import asynccontextmanager
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response, Depends, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from storage import Storage
-
-app = FastAPI(title="Knowledge Extraction System API")
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, RedirectResponse
+from storage import Storage, fts_query, read_counters, neighborhood
+from db_pool import ConnectionPool, DbWriter, PoolTimeout
+from export import iter_graphml, chunked, JsonLdCache, jsonld_cache_dir
+from graph_cache import GraphCache, graph_cache_dir
+from ingest import SUPPORTED
+from ocr_cache import OcrCache, ocr_cache_path
+from nlp_cache import nlp_cache_path
+from worker import ExtractionWorkerPool
+from jobs import QueueFull, JobActive, job_view
+from utils import setup_logging
+import metrics
 
 # ---------------------------------------------------
 # CONFIG
 # ---------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "out.sqlite")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "out.sqlite"))
+INPUT_DIR = os.environ.get("INPUT_DIR", os.path.join(BASE_DIR, "input_docs"))
+
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", "1"))
+# ru, en или auto (язык определяется для каждого предложения)
+NLP_LANG = os.environ.get("NLP_LANG", "ru")
+NLP_BATCH_SIZE = int(os.environ.get("NLP_BATCH_SIZE", "64"))
+NLP_N_PROCESS = int(os.environ.get("NLP_N_PROCESS", "1"))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "100"))
+# 0 — по числу ядер
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "0")) or None
+OCR_PAGE_TIMEOUT = int(os.environ.get("OCR_PAGE_TIMEOUT", "120"))
+# кэш результатов OCR; 0 — выключен
+OCR_CACHE_MB = int(os.environ.get("OCR_CACHE_MB", "256"))
+# кэш результатов NLP по предложениям: записей в памяти (0 — выключен)
+# и SQLite-уровень на диске
+NLP_CACHE_ENTRIES = int(os.environ.get("NLP_CACHE_ENTRIES", "50000"))
+NLP_CACHE_PERSIST = os.environ.get("NLP_CACHE_PERSIST", "1") == "1"
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "100"))
+# соединений чтения на процесс API
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "16"))
+# кэш ответов /graph/{doc_id}: LRU в памяти (0 — выключен) и файлы на диске
+GRAPH_CACHE_MB = int(os.environ.get("GRAPH_CACHE_MB", "64"))
+GRAPH_CACHE_PERSIST = os.environ.get("GRAPH_CACHE_PERSIST", "1") == "1"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# запас на заголовки частей multipart сверх MAX_UPLOAD_MB
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+jsonld_cache = JsonLdCache(jsonld_cache_dir(DB_PATH))
+ocr_cache = OcrCache(ocr_cache_path(DB_PATH)) if OCR_CACHE_MB else None
+graph_cache = GraphCache(
+    graph_cache_dir(DB_PATH) if GRAPH_CACHE_PERSIST else None,
+    memory_bytes=GRAPH_CACHE_MB * 1024 * 1024,
+) if GRAPH_CACHE_MB else None
+
+# схема создаётся/обновляется до первого запроса; соединение инициализации
+# не держится — запросы API идут через пул чтения и единственный writer
+_storage = Storage(DB_PATH)
+_storage.init_db()
+_storage.close()
+
+read_pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+writer = DbWriter(DB_PATH)
+
+# постановка заданий в очередь идёт через тот же writer
+workers = ExtractionWorkerPool(
+    DB_PATH,
+    workers=EXTRACT_WORKERS,
+    lang=NLP_LANG,
+    batch_size=NLP_BATCH_SIZE,
+    n_process=NLP_N_PROCESS,
+    max_queued=MAX_QUEUED_JOBS,
+    ocr_workers=OCR_WORKERS,
+    page_timeout=OCR_PAGE_TIMEOUT,
+    ocr_cache_path=ocr_cache_path(DB_PATH) if OCR_CACHE_MB else None,
+    ocr_cache_max_bytes=OCR_CACHE_MB * 1024 * 1024,
+    nlp_cache_entries=NLP_CACHE_ENTRIES,
+    nlp_cache_path=nlp_cache_path(DB_PATH) if NLP_CACHE_PERSIST else None,
+    writer=writer,
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    workers.start()
+    yield
+    workers.stop(timeout=5)
+    read_pool.close()
+    writer.close()
+
+
+app = FastAPI(title="Knowledge Extraction System API", lifespan=lifespan)
+if metrics.ENABLED:
+    app.add_middleware(metrics.HttpMetricsMiddleware)
+
+
+# ---------------------------------------------------
+# DB DEPENDENCIES
+# ---------------------------------------------------
+def read_db():
+    # синхронная зависимость: ожидание свободного соединения идёт
+    # в threadpool, а не в event loop
+    with read_pool.connection() as conn:
+        yield conn
+
+
+def write_db():
+    with writer.transaction() as conn:
+        yield conn
+
+
+# scope="request": соединение возвращается в пул после отправки ответа,
+# потоковые ответы читают из него до конца тела
+READ_DB = Depends(read_db, scope="request")
+# транзакция записи завершается сразу после обработчика
+WRITE_DB = Depends(write_db, scope="function")
 
-def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
 
-storage = Storage(DB_PATH)
-storage.init_db()
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+# ---------------------------------------------------
+# PAGINATION / STREAMED JSON
+# ---------------------------------------------------
+def select_fields(fields, columns):
+    """
+    Проекция полей: fields — "id,name" из запроса, columns — поле ответа -> SQL.
+    Возвращает SQL для SELECT с псевдонимами полей ответа.
+    """
+    keys = list(columns)
+    if fields:
+        keys = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [k for k in keys if k not in columns]
+        if unknown or not keys:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}; allowed: {', '.join(columns)}"
+            )
+    return ", ".join(f'{columns[k]} AS "{k}"' for k in keys)
+
+
+def keyset_next(conn, table, where, params, limit):
+    """
+    Курсор следующей страницы для выборки ORDER BY id DESC: id последней
+    строки страницы, если за ней есть ещё строки, иначе None.
+    """
+    last = conn.execute(f"""
+        SELECT id FROM {table} WHERE {where}
+        ORDER BY id DESC LIMIT 1 OFFSET ?
+    """, (*params, limit - 1)).fetchone()
+    if not last:
+        return None
+    more = conn.execute(
+        f"SELECT 1 FROM {table} WHERE {where} AND id < ? LIMIT 1", (*params, last[0])
+    ).fetchone()
+    return last[0] if more else None
+
+
+def json_array_response(rows, headers=None):
+    """JSON-массив, кодируемый построчно прямо из курсора."""
+    def stream():
+        yield "["
+        first = True
+        for r in rows:
+            yield ("" if first else ",") + json.dumps(dict(r), ensure_ascii=False)
+            first = False
+        yield "]"
+
+    return StreamingResponse(chunked(stream()), media_type="application/json", headers=headers)
+
+
+def cursor_headers(next_cursor=None, next_offset=None):
+    headers = {}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if next_offset is not None:
+        headers["X-Next-Offset"] = str(next_offset)
+    return headers
 
 # ---------------------------------------------------
 # UPLOAD + PIPELINE
 # ---------------------------------------------------
+class UploadSizeLimit:
+    """
+    ASGI-middleware: 413 для загрузки больше max_bytes до того, как Starlette
+    разберёт multipart и сохранит файл целиком. Запрос с Content-Length
+    больше предела отклоняется сразу, без чтения тела; без Content-Length
+    (chunked) — как только прочитано больше max_bytes.
+    """
+
+    def __init__(self, app, paths, max_bytes):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": self.detail()})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self.detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def detail():
+        return f"Файл больше {MAX_UPLOAD_MB} МБ"
+
+
+app.add_middleware(
+    UploadSizeLimit,
+    paths={"/extract"},
+    max_bytes=MAX_UPLOAD_MB * 1024 * 1024 + UPLOAD_FORM_OVERHEAD,
+)
+
+
+async def save_upload(file: UploadFile):
+    """
+    Потоково пишет загрузку во временный файл в INPUT_DIR, считая sha256.
+    Файл сохраняется под именем <sha256><ext>: одинаковое содержимое не
+    дублируется на диске, а загрузки с одинаковым именем не перезаписывают
+    друг друга. Превышение MAX_UPLOAD_MB — 413 (запрос, заведомо больший,
+    отклоняет UploadSizeLimit ещё до разбора формы). Возвращает (path, sha256).
+    """
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    limit = MAX_UPLOAD_MB * 1024 * 1024
+    h = hashlib.sha256()
+    size = 0
+
+    fd, tmp = tempfile.mkstemp(dir=INPUT_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=UploadSizeLimit.detail())
+                h.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+
+        sha256 = h.hexdigest()
+        path = os.path.join(INPUT_DIR, f"{sha256}{ext}")
+        if os.path.exists(path):
+            # то же содержимое уже на диске: сохраняем его mtime для манифеста
+            os.remove(tmp)
+        else:
+            # атомарно: обработчик не увидит недописанный файл
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path, sha256
+
+
+def remove_unreferenced_files(paths):
+    """
+    Удаляет из input_docs файлы, на которые не ссылается ни одна строка
+    манифеста или задания: загрузки хранятся по хэшу содержимого, один
+    файл может принадлежать нескольким документам.
+    """
+    with writer.transaction() as conn:
+        for file_path in paths:
+            referenced = conn.execute("""
+                SELECT 1 FROM files WHERE path=?
+                UNION ALL
+                SELECT 1 FROM jobs WHERE path=?
+                LIMIT 1
+            """, (file_path, file_path)).fetchone()
+            if referenced is None and os.path.exists(file_path):
+                os.remove(file_path)
+
+
+def job_conflict(e):
+    """409 для документа, у которого уже есть активное задание (jobs.JobActive)."""
+    return HTTPException(status_code=409, detail=str(e),
+                         headers={"Location": f"/jobs/{e.job['id']}"})
+
+
 @app.post("/extract")
 async def extract(file: UploadFile = File(...)):
-    os.makedirs("input_docs", exist_ok=True)
+    # неподдерживаемый формат отклоняется до сохранения файла и создания документа
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in SUPPORTED:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неподдерживаемый формат файла: {ext or 'без расширения'} "
+                   f"(поддерживаются {', '.join(SUPPORTED)})",
+        )
 
-    save_path = os.path.join(BASE_DIR, "input_docs", file.filename)
-    with open(save_path, "wb") as f:
-        f.write(await file.read())
+    save_path, sha256 = await save_upload(file)
 
-    # запуск pipeline
-    os.system(f"python pipeline.py --input input_docs --output \"{DB_PATH}\"")
+    # обработка в резидентном пуле воркеров, ответ возвращается сразу
+    try:
+        job = await run_in_threadpool(
+            workers.submit, save_path, filename=file.filename, sha256=sha256
+        )
+    except QueueFull as e:
+        # транзакция submit откатилась: файл удаляется, если на него
+        # не ссылается другой документ
+        await run_in_threadpool(remove_unreferenced_files, [save_path])
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+    except JobActive as e:
+        raise job_conflict(e)
+
+    return {
+        "status": "duplicate" if job["duplicate"] else "queued",
+        "filename": file.filename,
+        "jobId": job["id"],
+        "documentId": job["document_id"],
+    }
+
+# ---------------------------------------------------
+# JOB STATUS
+# ---------------------------------------------------
+JOB_POLL_INTERVAL = 0.5
+JOB_DONE = ("completed", "failed")
+
+
+def read_job(job_id):
+    with read_pool.connection() as conn:
+        return workers.get_job(job_id, conn=conn)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: ждать изменения до wait секунд"),
+    version: int | None = Query(None, description="Версия задания, известная клиенту"),
+):
+    job = await run_in_threadpool(read_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # long-poll: ответ, как только версия задания отличается от известной клиенту
+    deadline = asyncio.get_running_loop().time() + wait
+    while (wait and version is not None and job["version"] == version
+           and job["status"] not in JOB_DONE
+           and asyncio.get_running_loop().time() < deadline):
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        job = await run_in_threadpool(read_job, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    return job_view(job)
 
-    return {"status": "ok", "filename": file.filename}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: progress при каждом изменении задания, done в конце."""
+    job = await run_in_threadpool(read_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream(job):
+        version = None
+        while job:
+            if job["version"] != version:
+                version = job["version"]
+                event = "done" if job["status"] in JOB_DONE else "progress"
+                yield f"event: {event}\ndata: {json.dumps(job_view(job), ensure_ascii=False)}\n\n"
+                if event == "done":
+                    return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            job = await run_in_threadpool(read_job, job_id)
+
+    return StreamingResponse(
+        stream(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 # ---------------------------------------------------
 # LIST DOCUMENTS
 # ---------------------------------------------------
+DOCUMENT_FIELDS = {
+    "id": "id",
+    "name": "filename",
+    "uploadedAt": "uploaded_at",
+    "status": "status",
+    "entities": "entities_count",
+    "sentences": "sentences_count",
+}
+
+
 @app.get("/documents")
-def list_documents():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+def list_documents(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int | None = Query(None, description="id последнего документа предыдущей страницы"),
+    fields: str | None = Query(None, description="Поля через запятую"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    columns = select_fields(fields, DOCUMENT_FIELDS)
 
-    rows = c.execute("""
-        SELECT 
-            id,
-            filename,
-            uploaded_at,
-            status,
-            entities_count,
-            sentences_count
+    # keyset-пагинация по id (новые первыми)
+    where = "id < ?" if after else "1=1"
+    params = (after,) if after else ()
+    next_cursor = keyset_next(conn, "documents", where, params, limit)
+
+    rows = conn.execute(f"""
+        SELECT {columns}
         FROM documents
+        WHERE {where}
         ORDER BY id DESC
-    """).fetchall()
-
-    docs = []
-    for r in rows:
-        docs.append({
-            "id": r["id"],
-            "name": r["filename"],
-            "uploadedAt": r["uploaded_at"],
-            "status": r["status"],
-            "entities": r["entities_count"],
-            "sentences": r["sentences_count"],
-        })
+        LIMIT ?
+    """, (*params, limit))
 
-    return docs
+    return json_array_response(rows, cursor_headers(next_cursor))
 
 
 # ---------------------------------------------------
 # GRAPH FOR A DOCUMENT
 # ---------------------------------------------------
+GRAPH_FORMATS = ("json", "compact")
+
+
 @app.get("/graph/{doc_id}")
-def api_graph(doc_id: int):
-    conn = db()
+def api_graph(
+    doc_id: int,
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=10000, description="Предложений на страницу"),
+    after: int | None = Query(None, description="id последнего предложения предыдущей страницы"),
+    format: str = Query("json", description="json или compact (столбцы, связи — индексы узлов)"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    if format not in GRAPH_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
     c = conn.cursor()
 
-    doc = c.execute("SELECT filename FROM documents WHERE id=?", (doc_id,)).fetchone()
+    doc = c.execute("SELECT filename, status FROM documents WHERE id=?", (doc_id,)).fetchone()
     if not doc:
-        return {"nodes": [], "links": []}
+        return {"nodes": [], "links": [], "next": None}
 
-    filename = doc["filename"]
+    # граф обработанного документа не меняется до переобработки или удаления:
+    # версия графа — ETag и ключ кэша
+    version = _graph_version(c, doc_id) if doc["status"] == "completed" else None
+    # у страницы свой ETag: её тело зависит от limit и after
+    page_tag = f"-{limit or ''}-{after or ''}" if limit or after else ""
+    etag = f'W/"graph-{doc_id}-{version}-{format}{page_tag}"' if version else None
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
-    nodes = []
-    links = []
+    # страница — диапазон id предложений (after, last]; сущности и отношения
+    # выбираются по sentence_id из того же диапазона
+    sent_filter = "document_id=?"
+    child_filter = "document_id=?"
+    params = [doc_id]
+    if after:
+        sent_filter += " AND id > ?"
+        child_filter += " AND sentence_id > ?"
+        params.append(after)
 
-    # document node
-    nodes.append({
-        "id": f"doc_{doc_id}",
-        "label": filename,
-        "type": "document"
-    })
+    next_cursor = None
+    if limit:
+        last = c.execute(f"""
+            SELECT id FROM sentences WHERE {sent_filter}
+            ORDER BY id LIMIT 1 OFFSET ?
+        """, (*params, limit - 1)).fetchone()
+        if last:
+            if c.execute(
+                f"SELECT 1 FROM sentences WHERE {sent_filter} AND id > ? LIMIT 1",
+                (*params, last[0])
+            ).fetchone():
+                next_cursor = last[0]
+            sent_filter += " AND id <= ?"
+            child_filter += " AND sentence_id <= ?"
+            params.append(last[0])
+
+    page = (doc_id, doc["filename"], after is None, sent_filter, child_filter, tuple(params))
+
+    # полный граф — из кэша, сжатый gzip один раз при построении
+    if graph_cache and version and not limit and not after:
+        body = graph_cache.get(doc_id, version, format)
+        if body is None:
+            body = graph_cache.put(doc_id, version, format, _graph_bytes(conn, page, next_cursor, format))
+        return _gzip_response(request, body, etag)
+
+    headers = {"ETag": etag} if etag else None
+    if format == "compact":
+        return Response(_graph_bytes(conn, page, next_cursor, format),
+                        media_type="application/json", headers=headers)
+    return StreamingResponse(
+        chunked(_graph_json(conn, page, next_cursor)), media_type="application/json", headers=headers
+    )
+
+
+def _graph_version(c, doc_id):
+    """
+    Версия графа документа: диапазон id его предложений. При переобработке
+    предложения получают новые (большие) id, поэтому версия меняется.
+    """
+    first, last = c.execute("""
+        SELECT (SELECT MIN(id) FROM sentences WHERE document_id=?),
+               (SELECT MAX(id) FROM sentences WHERE document_id=?)
+    """, (doc_id, doc_id)).fetchone()
+    return f"{first or 0}-{last or 0}"
+
+
+def _gzip_response(request, body, etag):
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(body, media_type="application/json", headers=headers)
+    return Response(gzip.decompress(body), media_type="application/json", headers=headers)
+
+
+def _graph_bytes(conn, page, next_cursor, fmt):
+    if fmt == "compact":
+        graph = _compact_graph(conn, page, next_cursor)
+        return json.dumps(graph, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return "".join(_graph_json(conn, page, next_cursor)).encode("utf-8")
+
+
+def _graph_json(conn, page, next_cursor):
+    yield '{"nodes":['
+    yield from _json_items(_graph_nodes(conn, *page))
+    yield '],"links":['
+    yield from _json_items(_graph_links(conn, *page))
+    yield f'],"next":{json.dumps(next_cursor)}}}'
+
+
+def _compact_graph(conn, page, next_cursor):
+    """
+    Граф в столбцах: узлы и связи — параллельные массивы, типы узлов и
+    подписи связей — словари, концы связей — индексы узлов. Строковый id
+    узла — префикс по типу (doc_, sent_, rel_, для сущностей ent_) и key.
+    Связи с узлами других страниц ссылаются на refs: индекс len(key) + i.
+    """
+    types, node_type, node_key, node_label = [], [], [], []
+    type_index, index = {}, {}
+    for node in _graph_nodes(conn, *page):
+        t = type_index.setdefault(node["type"], len(types))
+        if t == len(types):
+            types.append(node["type"])
+        index[node["id"]] = len(node_key)
+        node_type.append(t)
+        node_key.append(int(node["id"].rpartition("_")[2]))
+        node_label.append(node["label"])
+
+    refs = []
+
+    def node_index(node_id):
+        i = index.get(node_id)
+        if i is None:
+            i = index[node_id] = len(node_key) + len(refs)
+            refs.append(node_id)
+        return i
+
+    link_labels, source, target, link_label = [], [], [], []
+    label_index = {}
+    for link in _graph_links(conn, *page):
+        label = label_index.setdefault(link["label"], len(link_labels))
+        if label == len(link_labels):
+            link_labels.append(link["label"])
+        source.append(node_index(link["source"]))
+        target.append(node_index(link["target"]))
+        link_label.append(label)
+
+    return {
+        "types": types,
+        "nodes": {"type": node_type, "key": node_key, "label": node_label},
+        "linkLabels": link_labels,
+        "links": {"source": source, "target": target, "label": link_label},
+        "refs": refs,
+        "next": next_cursor,
+    }
+
+
+def _json_items(items):
+    first = True
+    for item in items:
+        yield ("" if first else ",") + json.dumps(item, ensure_ascii=False)
+        first = False
+
+
+def _graph_nodes(conn, doc_id, filename, with_doc, sent_filter, child_filter, params):
+    # document node (только на первой странице)
+    if with_doc:
+        yield {
+            "id": f"doc_{doc_id}",
+            "label": filename,
+            "type": "document"
+        }
 
     # sentences
-    for r in c.execute("SELECT id, text FROM sentences WHERE document_id=?", (doc_id,)):
-        sid, text = r["id"], r["text"]
-        nodes.append({
+    for sid, text in conn.execute(f"SELECT id, text FROM sentences WHERE {sent_filter}", params):
+        yield {
             "id": f"sent_{sid}",
             "label": text[:40] + "...",
             "type": "sentence"
-        })
-        links.append({
-            "id": f"doc_sent_{sid}",
-            "source": f"doc_{doc_id}",
-            "target": f"sent_{sid}",
-            "label": "contains"
-        })
+        }
 
     # entities
-    for r in c.execute("""
-        SELECT id, text, label, sentence_id 
-        FROM entities WHERE document_id=?
-    """, (doc_id,)):
-        eid, text, label, sid = r
-        nodes.append({
+    for eid, text, label in conn.execute(f"""
+        SELECT id, text, label FROM entities WHERE {child_filter}
+    """, params):
+        yield {
             "id": f"ent_{eid}",
             "label": text,
             "type": (label or "other").lower()
-        })
-        links.append({
-            "id": f"ent_link_{eid}",
-            "source": f"sent_{sid}",
-            "target": f"ent_{eid}",
-            "label": "mentions"
-        })
+        }
 
     # relations
-    for r in c.execute("""
-        SELECT id, sentence_id, subj, pred, obj
-        FROM relations WHERE document_id=?
-    """, (doc_id,)):
-        rid, sid, subj, pred, obj = r
-
-        nodes.append({
+    for rid, pred in conn.execute(f"""
+        SELECT id, pred FROM relations WHERE {child_filter}
+    """, params):
+        yield {
             "id": f"rel_{rid}",
             "label": pred,
             "type": "relation"
-        })
-        links.append({
+        }
+
+
+def _graph_links(conn, doc_id, filename, with_doc, sent_filter, child_filter, params):
+    for (sid,) in conn.execute(f"SELECT id FROM sentences WHERE {sent_filter}", params):
+        yield {
+            "id": f"doc_sent_{sid}",
+            "source": f"doc_{doc_id}",
+            "target": f"sent_{sid}",
+            "label": "contains"
+        }
+
+    for eid, sid in conn.execute(f"""
+        SELECT id, sentence_id FROM entities WHERE {child_filter}
+    """, params):
+        yield {
+            "id": f"ent_link_{eid}",
+            "source": f"sent_{sid}",
+            "target": f"ent_{eid}",
+            "label": "mentions"
+        }
+
+    # relations (сущности subj/obj связаны при извлечении)
+    for rid, sid, subj_eid, obj_eid in conn.execute(f"""
+        SELECT id, sentence_id, subj_entity_id, obj_entity_id
+        FROM relations WHERE {child_filter}
+    """, params):
+        yield {
             "id": f"rel_sent_{rid}",
             "source": f"sent_{sid}",
             "target": f"rel_{rid}",
             "label": "context"
-        })
-
-        # subj entity
-        rs = c.execute("""
-            SELECT id FROM entities 
-            WHERE document_id=? AND text=? COLLATE NOCASE LIMIT 1
-        """, (doc_id, subj)).fetchone()
-        if rs:
-            links.append({
+        }
+
+        if subj_eid:
+            yield {
                 "id": f"rel_subj_{rid}",
-                "source": f"ent_{rs['id']}",
+                "source": f"ent_{subj_eid}",
                 "target": f"rel_{rid}",
                 "label": "subj"
-            })
-
-        # obj entity
-        ro = c.execute("""
-            SELECT id FROM entities 
-            WHERE document_id=? AND text=? COLLATE NOCASE LIMIT 1
-        """, (doc_id, obj)).fetchone()
-        if ro:
-            links.append({
+            }
+
+        if obj_eid:
+            yield {
                 "id": f"rel_obj_{rid}",
                 "source": f"rel_{rid}",
-                "target": f"ent_{ro['id']}",
+                "target": f"ent_{obj_eid}",
                 "label": "obj"
-            })
-
-    return {"nodes": nodes, "links": links}
+            }
 
 # ---------------------------------------------------
 # EXPORT
 # ---------------------------------------------------
+# собранный интерфейс (ui/dist) ссылается на /graphml и /jsonld
+@app.get("/graphml", include_in_schema=False)
+def legacy_graphml():
+    return RedirectResponse("/export/graphml")
+
+
+@app.get("/jsonld", include_in_schema=False)
+def legacy_jsonld():
+    return RedirectResponse("/export/jsonld")
+
+
 @app.get("/export/graphml")
-def export_graphml():
-    path = os.path.join(BASE_DIR, "graph.out.graphml")
-    if not os.path.exists(path):
-        raise HTTPException(404, "GraphML not generated")
-    return FileResponse(path)
+def export_graphml(
+    document_id: int | None = Query(None),
+    conn: sqlite3.Connection = READ_DB,
+):
+    if document_id and not conn.execute(
+        "SELECT 1 FROM documents WHERE id=?", (document_id,)
+    ).fetchone():
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    name = f"graph.{document_id}.graphml" if document_id else "graph.graphml"
+    return StreamingResponse(
+        iter_graphml(conn, document_id),
+        media_type="application/graphml+xml",
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
 
 @app.get("/export/jsonld")
-def export_jsonld():
-    path = os.path.join(BASE_DIR, "graph.out.jsonld")
-    if not os.path.exists(path):
-        raise HTTPException(404, "JSON-LD not generated")
-    return FileResponse(path)
+def export_jsonld(
+    request: Request,
+    document_id: int | None = Query(None),
+    conn: sqlite3.Connection = READ_DB,
+):
+    if document_id and not conn.execute(
+        "SELECT 1 FROM documents WHERE id=?", (document_id,)
+    ).fetchone():
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    etag = jsonld_cache.etag(conn, document_id)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    name = f"graph.{document_id}.jsonld" if document_id else "graph.jsonld"
+    return StreamingResponse(
+        jsonld_cache.iter_export(conn, document_id),
+        media_type="application/ld+json",
+        headers={
+            "ETag": etag,
+            "Content-Disposition": f'attachment; filename="{name}"',
+        },
+    )
 
 # ---------------------------------------------------
 # ENTITIES SEARCH
 # ---------------------------------------------------
+# entities — представление: упоминания (mentions) с текстом упоминания и меткой
+# канонической сущности; entityId — id в словаре (/canonical-entities)
+ENTITY_FIELDS = {
+    "id": "e.id",
+    "text": "e.text",
+    "type": "e.label",
+    "documentId": "e.document_id",
+    "sentenceId": "e.sentence_id",
+    "entityId": "e.entity_id",
+}
+
+
 @app.get("/entities")
-def get_entities(q: str | None = Query(None)):
-    conn = db()
-    rows = conn.execute("""
-        SELECT 
-            e.id, e.text, e.label, s.document_id, e.sentence_id
+def get_entities(
+    q: str | None = Query(None),
+    document_id: int | None = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0, description="Смещение для ранжированного поиска (q)"),
+    after: int | None = Query(None, description="Курсор (id) для выборки без q"),
+    fields: str | None = Query(None, description="Поля через запятую"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    columns = select_fields(fields, ENTITY_FIELDS)
+    match = fts_query(q)
+    doc_filter = "AND e.document_id = ?" if document_id else ""
+    doc_params = (document_id,) if document_id else ()
+
+    if match:
+        # ранжированный поиск по FTS5-индексу словаря сущностей (bm25),
+        # упоминания — по индексу mentions(entity_id); порядок по рангу,
+        # поэтому страницы — по смещению
+        rows = conn.execute(f"""
+            SELECT {columns}
+            FROM entity_dict_fts f
+            JOIN entities e ON e.entity_id = f.rowid
+            WHERE entity_dict_fts MATCH ? {doc_filter}
+            ORDER BY f.rank, e.id
+            LIMIT ? OFFSET ?
+        """, (match, *doc_params, limit + 1, offset)).fetchall()
+        headers = cursor_headers(next_offset=offset + limit if len(rows) > limit else None)
+        return json_array_response(rows[:limit], headers)
+
+    if q and q.strip():
+        # в запросе нет слов (только знаки) — искать нечего
+        return []
+
+    # без запроса — keyset-пагинация по id (новые первыми)
+    where = "1=1"
+    params = doc_params
+    if document_id:
+        where = "document_id = ?"
+    if after:
+        where += " AND id < ?"
+        params = (*params, after)
+    next_cursor = keyset_next(conn, "mentions", where, params, limit)
+
+    rows = conn.execute(f"""
+        SELECT {columns}
         FROM entities e
-        JOIN sentences s ON s.id = e.sentence_id
-        WHERE e.text LIKE ?
+        WHERE {where}
         ORDER BY e.id DESC
-    """, (f"%{q}%" if q else "%",)).fetchall()
+        LIMIT ?
+    """, (*params, limit))
+
+    return json_array_response(rows, cursor_headers(next_cursor))
+
+# ---------------------------------------------------
+# CANONICAL ENTITIES
+# ---------------------------------------------------
+CANONICAL_FIELDS = {
+    "id": "d.id",
+    "text": "d.text",
+    "type": "NULLIF(d.label, '')",
+    "mentions": "d.mention_count",
+}
+
+
+@app.get("/canonical-entities")
+def get_canonical_entities(
+    q: str | None = Query(None),
+    type: str | None = Query(None, description="Метка сущности (PER, ORG, ...)"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0, description="Смещение для ранжированного поиска (q)"),
+    after: int | None = Query(None, description="Курсор (id) для выборки без q"),
+    fields: str | None = Query(None, description="Поля через запятую"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    """Словарь сущностей корпуса: одна запись на сущность во всех документах."""
+    columns = select_fields(fields, CANONICAL_FIELDS)
+    match = fts_query(q)
+    label_filter = "AND d.label = ?" if type else ""
+    label_params = (type,) if type else ()
+
+    if match:
+        rows = conn.execute(f"""
+            SELECT {columns}
+            FROM entity_dict_fts f
+            JOIN entity_dict d ON d.id = f.rowid
+            WHERE entity_dict_fts MATCH ? {label_filter}
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+        """, (match, *label_params, limit + 1, offset)).fetchall()
+        headers = cursor_headers(next_offset=offset + limit if len(rows) > limit else None)
+        return json_array_response(rows[:limit], headers)
+
+    if q and q.strip():
+        return []
+
+    where = "label = ?" if type else "1=1"
+    params = label_params
+    if after:
+        where += " AND id < ?"
+        params = (*params, after)
+    next_cursor = keyset_next(conn, "entity_dict", where, params, limit)
+
+    rows = conn.execute(f"""
+        SELECT {columns}
+        FROM entity_dict d
+        WHERE {where}
+        ORDER BY d.id DESC
+        LIMIT ?
+    """, (*params, limit))
+
+    return json_array_response(rows, cursor_headers(next_cursor))
+
+
+@app.get("/canonical-entities/{entity_id}/documents")
+def canonical_entity_documents(
+    entity_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    after: int | None = Query(None, description="id последнего документа предыдущей страницы"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    """Документы, в которых упоминается сущность, с числом упоминаний в каждом."""
+    if not conn.execute("SELECT 1 FROM entity_dict WHERE id=?", (entity_id,)).fetchone():
+        raise HTTPException(status_code=404, detail="Entity not found")
+
+    # группировка по индексу mentions(entity_id, document_id), без скана упоминаний корпуса
+    rows = conn.execute("""
+        SELECT m.document_id AS documentId, d.filename AS name, COUNT(*) AS mentions
+        FROM mentions m
+        JOIN documents d ON d.id = m.document_id
+        WHERE m.entity_id = ? AND m.document_id > ?
+        GROUP BY m.document_id
+        ORDER BY m.document_id
+        LIMIT ?
+    """, (entity_id, after or 0, limit + 1)).fetchall()
+    next_cursor = rows[limit - 1]["documentId"] if len(rows) > limit else None
+    return json_array_response(rows[:limit], cursor_headers(next_cursor))
+
+# ---------------------------------------------------
+# ENTITY NEIGHBORHOOD (CORPUS GRAPH)
+# ---------------------------------------------------
+NEIGHBORHOOD_SEEDS = 10
+
+
+@app.get("/neighborhood")
+def entity_neighborhood(
+    entity_id: list[int] = Query([], description="Начальные сущности (id из /canonical-entities)"),
+    q: str | None = Query(None, description="Поиск начальных сущностей по тексту"),
+    hops: int = Query(1, ge=1, le=4),
+    max_nodes: int = Query(200, ge=1, le=5000),
+    max_edges: int = Query(1000, ge=1, le=20000),
+    min_weight: int = Query(1, ge=1, description="Минимум отношений на ребро"),
+    pred: str | None = Query(None, description="Только рёбра с этим предикатом"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    """
+    Граф корпуса вокруг сущностей: k-hop окрестность по индексу смежности
+    entity_edges (поддерживается триггерами при записи и удалении документов).
+    Узлы — канонические сущности, рёбра — отношения между ними во всех
+    документах с весом (числом отношений).
+    """
+    seeds = list(dict.fromkeys(entity_id))
+    match = fts_query(q)
+    if match:
+        seeds += [row[0] for row in conn.execute("""
+            SELECT rowid FROM entity_dict_fts
+            WHERE entity_dict_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (match, NEIGHBORHOOD_SEEDS)) if row[0] not in seeds]
+    elif not seeds:
+        if q and q.strip():
+            return {"nodes": [], "links": [], "truncated": False}
+        raise HTTPException(status_code=400, detail="entity_id or q is required")
+
+    seeds = [row[0] for row in conn.execute(
+        "SELECT id FROM entity_dict WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(seeds),)
+    )]
+    if not seeds and entity_id:
+        raise HTTPException(status_code=404, detail="Entity not found")
+
+    nodes, edges, truncated = neighborhood(
+        conn, seeds, hops=hops, max_nodes=max_nodes, max_edges=max_edges,
+        min_weight=min_weight, pred=pred,
+    )
+
+    info = {row[0]: row[1:] for row in conn.execute("""
+        SELECT id, text, label, mention_count FROM entity_dict
+        WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(nodes)),))}
+
+    return {
+        "nodes": [
+            {
+                "id": f"entity_{node}",
+                "label": info[node][0],
+                "type": (info[node][1] or "other").lower(),
+                "hop": hop,
+                "mentions": info[node][2],
+            }
+            for node, hop in nodes.items() if node in info
+        ],
+        "links": [
+            {
+                "id": f"edge_{i}",
+                "source": f"entity_{src}",
+                "target": f"entity_{dst}",
+                "label": edge_pred,
+                "weight": weight,
+            }
+            for i, (src, dst, edge_pred, weight) in enumerate(edges)
+        ],
+        "truncated": truncated,
+    }
+
+# ---------------------------------------------------
+# SENTENCES SEARCH
+# ---------------------------------------------------
+@app.get("/sentences/search")
+def search_sentences(
+    q: str = Query(..., min_length=1),
+    document_id: int | None = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    conn: sqlite3.Connection = READ_DB,
+):
+    match = fts_query(q)
+    if not match:
+        return []
+
+    doc_filter = "AND s.document_id = ?" if document_id else ""
+    doc_params = (document_id,) if document_id else ()
+
+    rows = conn.execute(f"""
+        SELECT
+            s.id, s.document_id, s.text,
+            snippet(sentences_fts, 0, '<b>', '</b>', '…', 16) AS snippet
+        FROM sentences_fts
+        JOIN sentences s ON s.id = sentences_fts.rowid
+        WHERE sentences_fts MATCH ? {doc_filter}
+        ORDER BY sentences_fts.rank
+        LIMIT ? OFFSET ?
+    """, (match, *doc_params, limit, offset)).fetchall()
 
     return [
         {
             "id": r["id"],
-            "text": r["text"],
-            "type": r["label"],
             "documentId": r["document_id"],
-            "sentenceId": r["sentence_id"]
+            "text": r["text"],
+            "snippet": r["snippet"]
         }
         for r in rows
     ]
@@ -224,32 +1017,56 @@ def get_entities(q: str | None = Query(None)):
 # STATS
 # ---------------------------------------------------
 @app.get("/stats")
-def api_get_stats():
-    conn = db()
-    stats = conn.execute("""
-        SELECT 
-            COUNT(*) as total_documents,
-            SUM(entities_count) as total_entities,
-            SUM(sentences_count) as total_sentences
-        FROM documents
-    """).fetchone()
-
-    relations = conn.execute("SELECT COUNT(*) as total_relations FROM relations").fetchone()
+def api_get_stats(
+    top: int = Query(20, ge=0, le=1000, description="Самых частых предикатов отношений"),
+    conn: sqlite3.Connection = READ_DB,
+):
+    # счётчики поддерживаются триггерами (storage.COUNTERS), таблицы не сканируются;
+    # строки документов в обработке учитываются сразу
+    counters = read_counters(conn, top=top)
 
     return {
-        "documents": stats["total_documents"] or 0,
-        "entities": stats["total_entities"] or 0,
-        "sentences": stats["total_sentences"] or 0,
-        "relations": relations["total_relations"] or 0
+        "documents": counters["documents"],
+        "entities": counters["entities"],
+        "sentences": counters["sentences"],
+        "relations": counters["relations"],
+        "documentsByStatus": counters["documents_status"],
+        "canonicalEntities": counters["canonical_entities"],
+        "entitiesByLabel": counters["entity_label"],
+        "topPredicates": counters["relation_pred"],
+        "ocrCache": ocr_cache.stats() if ocr_cache else None,
+        "graphCache": graph_cache.stats() if graph_cache else None,
+        "nlpCache": workers.nlp_cache_stats(),
+        "dbPool": read_pool.stats(),
     }
 
 
+# ---------------------------------------------------
+# METRICS
+# ---------------------------------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def api_metrics():
+    """Метрики в текстовом формате Prometheus (METRICS=0 — выключены)."""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/documents/{doc_id}/timings")
+def document_timings(doc_id: int, conn: sqlite3.Connection = READ_DB):
+    """Время стадий последней обработки документа."""
+    doc = conn.execute("SELECT timings FROM documents WHERE id=?", (doc_id,)).fetchone()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return json.loads(doc["timings"]) if doc["timings"] else None
+
+
 # ---------------------------------------------------
 # DELETE DOCUMENT
 # ---------------------------------------------------
 @app.delete("/documents/{doc_id}")
-def delete_document(doc_id: int):
-    conn = db()
+def delete_document(doc_id: int, background_tasks: BackgroundTasks,
+                    conn: sqlite3.Connection = WRITE_DB):
     c = conn.cursor()
 
     # Получаем имя файла документа
@@ -257,18 +1074,27 @@ def delete_document(doc_id: int):
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    # Удаляем файл из input_docs
-    file_path = os.path.join(BASE_DIR, "input_docs", doc["filename"])
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    # Файлы документа в input_docs — только пути из его собственных строк
+    # манифеста и заданий (включая привязанные дубликаты); файл
+    # INPUT_DIR/<filename> без таких строк может принадлежать другому
+    # документу с тем же именем
+    paths = sorted({r["path"] for r in c.execute("""
+        SELECT path FROM files WHERE document_id=?
+        UNION
+        SELECT path FROM jobs WHERE document_id=? AND path IS NOT NULL
+    """, (doc_id, doc_id))})
 
-    # Удаляем все связанные записи из БД
-    c.execute("DELETE FROM relations WHERE document_id=?", (doc_id,))
-    c.execute("DELETE FROM entities WHERE document_id=?", (doc_id,))
-    c.execute("DELETE FROM sentences WHERE document_id=?", (doc_id,))
+    # Удаляем документ; предложения, сущности, отношения, файлы и задания —
+    # каскадно (транзакция фиксируется зависимостью write_db после обработчика)
     c.execute("DELETE FROM documents WHERE id=?", (doc_id,))
 
-    conn.commit()
+    # файлы удаляются после фиксации, и только те, на которые не ссылаются
+    # другие документы
+    background_tasks.add_task(remove_unreferenced_files, paths)
+
+    jsonld_cache.invalidate(doc_id)
+    if graph_cache:
+        graph_cache.invalidate(doc_id)
     return {"status": "ok", "deletedId": doc_id}
 
 
@@ -276,29 +1102,39 @@ def delete_document(doc_id: int):
 # REPROCESS DOCUMENT
 # ---------------------------------------------------
 @app.post("/reprocess/{doc_id}")
-def reprocess_document(doc_id: int):
-    conn = db()
+def reprocess_document(doc_id: int, conn: sqlite3.Connection = READ_DB):
     c = conn.cursor()
 
     doc = c.execute("SELECT filename FROM documents WHERE id=?", (doc_id,)).fetchone()
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    # Удаляем старые данные
-    c.execute("DELETE FROM relations WHERE document_id=?", (doc_id,))
-    c.execute("DELETE FROM entities WHERE document_id=?", (doc_id,))
-    c.execute("DELETE FROM sentences WHERE document_id=?", (doc_id,))
-    c.execute("DELETE FROM documents WHERE id=?", (doc_id,))
-    conn.commit()
-
-    # Запускаем пайплайн заново
-    file_path = os.path.join(BASE_DIR, "input_docs", doc["filename"])
-    if not os.path.exists(file_path):
+    # загрузки хранятся под именем <sha256><ext> (пути — в манифесте,
+    # затем в заданиях документа), старые — под исходным именем
+    paths = [r["path"] for r in c.execute(
+        "SELECT path FROM files WHERE document_id=?", (doc_id,)
+    )]
+    paths += [r["path"] for r in c.execute(
+        "SELECT path FROM jobs WHERE document_id=? ORDER BY created_at DESC", (doc_id,)
+    )]
+    paths.append(os.path.join(INPUT_DIR, doc["filename"]))
+    file_path = next((p for p in paths if os.path.exists(p)), None)
+    if file_path is None:
         raise HTTPException(status_code=404, detail="Original file not found")
 
-    os.system(f'python pipeline.py --input input_docs --output "{DB_PATH}"')
+    # Старые данные удаляются воркером перед повторной обработкой,
+    # документ сохраняет свой id
+    try:
+        job = workers.submit(file_path, filename=doc["filename"], doc_id=doc_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+    except JobActive as e:
+        raise job_conflict(e)
+    jsonld_cache.invalidate(doc_id)
+    if graph_cache:
+        graph_cache.invalidate(doc_id)
 
-    return {"status": "ok", "reprocessed": doc_id}
+    return {"status": "queued", "reprocessed": doc_id, "jobId": job["id"]}
 
 
 # ---------------------------------------------------
@@ -0,0 +1,69 @@
+# benchmarks/compare.py
+"""
+Сравнение двух результатов benchmarks.run:
+
+    python -m benchmarks.compare base.json new.json [--threshold 10]
+
+Для каждой стадии — изменение пропускной способности, пиковой памяти
+и p95 задержки (для API). Код выхода 1, если какая-то стадия медленнее
+базовой больше чем на threshold процентов.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report["meta"], {r["stage"]: r for r in report["results"]}
+
+
+def delta(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def fmt(value):
+    return "—" if value is None else f"{value:+.1f}%"
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Сравнение результатов бенчмарка")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0,
+                   help="Допустимое замедление стадии, %%")
+    args = p.parse_args(argv)
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print(f"base: {base_meta.get('commit')} ({base_meta.get('size')})  "
+          f"new: {new_meta.get('commit')} ({new_meta.get('size')})")
+    if base_meta.get("size") != new_meta.get("size"):
+        print("Внимание: разные размеры корпуса, сравнение некорректно")
+
+    print(f"{'stage':<28} {'throughput':>12} {'peak mem':>10} {'p95':>10}")
+    regressions = []
+    for stage in list(base) + [s for s in new if s not in base]:
+        old, cur = base.get(stage), new.get(stage)
+        if old is None or cur is None or "skipped" in old or "skipped" in cur:
+            print(f"{stage:<28} {'—':>12} {'—':>10} {'—':>10}")
+            continue
+        d_tp = delta(old.get("throughput"), cur.get("throughput"))
+        d_mem = delta(old.get("peak_mb"), cur.get("peak_mb"))
+        d_p95 = delta((old.get("latency_ms") or {}).get("p95"),
+                      (cur.get("latency_ms") or {}).get("p95"))
+        print(f"{stage:<28} {fmt(d_tp):>12} {fmt(d_mem):>10} {fmt(d_p95):>10}")
+        if d_tp is not None and d_tp < -args.threshold:
+            regressions.append(stage)
+
+    if regressions:
+        print(f"Замедление больше {args.threshold:.0f}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# benchmarks/corpus.py
+"""
+Генератор синтетического корпуса для бенчмарков.
+
+Корпус детерминирован (seed): текстовые PDF, «сканы» (PDF из изображений
+страниц, требуют Pillow) и DOCX (требуют python-docx). Текст содержит
+имена и организации, чтобы у заглушки NLP были сущности, и повторяющиеся
+шаблонные предложения (колонтитулы, дисклеймеры), как в реальных документах.
+Текстовые PDF пишутся без зависимостей стандартным шрифтом Helvetica,
+поэтому их текст — латиницей; DOCX и «сырой» текст — на русском.
+"""
+import os
+import random
+
+NAMES_RU = ["Иван Петров", "Анна Смирнова", "ООО Ромашка", "Газпром", "Москва",
+            "Санкт-Петербург", "Мария Иванова", "АО Вектор", "Министерство финансов"]
+VERBS_RU = ["заключил договор с", "направил письмо в", "получил платёж от",
+            "согласовал проект с", "передал документы в", "встретился с"]
+TAILS_RU = ["в рамках проекта", "по итогам квартала", "согласно приложению 2",
+            "в установленный срок", "для дальнейшего согласования"]
+BOILERPLATE_RU = [
+    "Настоящий документ является конфиденциальным.",
+    "Все права защищены.",
+    "Документ подписан электронной подписью.",
+]
+
+NAMES_EN = ["John Smith", "Acme Corp", "London", "Mary Jones", "Globex Inc",
+            "Ministry of Finance", "Peter Brown", "Initech", "New York"]
+VERBS_EN = ["signed a contract with", "sent a letter to", "received a payment from",
+            "approved the project with", "handed documents to", "met with"]
+TAILS_EN = ["within the project", "at the end of the quarter", "according to annex 2",
+            "on schedule", "for further approval"]
+BOILERPLATE_EN = [
+    "This document is confidential.",
+    "All rights reserved.",
+    "The document is signed electronically.",
+]
+
+SIZES = {
+    "small": {"documents": 2, "pages": 4, "sentences_per_page": 25},
+    "medium": {"documents": 4, "pages": 20, "sentences_per_page": 30},
+    "large": {"documents": 8, "pages": 60, "sentences_per_page": 40},
+}
+
+# доля шаблонных предложений
+BOILERPLATE_SHARE = 0.15
+
+
+def sentence(rng, lang="ru"):
+    if lang == "ru":
+        names, verbs, tails, boiler = NAMES_RU, VERBS_RU, TAILS_RU, BOILERPLATE_RU
+    else:
+        names, verbs, tails, boiler = NAMES_EN, VERBS_EN, TAILS_EN, BOILERPLATE_EN
+    if rng.random() < BOILERPLATE_SHARE:
+        return rng.choice(boiler)
+    return f"{rng.choice(names)} {rng.choice(verbs)} {rng.choice(names)} {rng.choice(tails)}."
+
+
+def pages(rng, n_pages, sentences_per_page, lang="ru"):
+    """Список страниц; страница — абзацы по 5 предложений."""
+    result = []
+    for p in range(n_pages):
+        sents = [sentence(rng, lang) for _ in range(sentences_per_page)]
+        paragraphs = [" ".join(sents[i:i + 5]) for i in range(0, len(sents), 5)]
+        result.append("\n".join(paragraphs) + f"\nPage {p + 1}")
+    return result
+
+
+# -----------------------------
+# WRITERS
+# -----------------------------
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap(text, width=90):
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                yield line
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        yield line
+
+
+def write_text_pdf(path, page_texts):
+    """Минимальный PDF с текстовым слоем (Helvetica, latin-1)."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for text in page_texts:
+        lines = ["BT /F1 10 Tf 12 TL 40 800 Td"]
+        for line in _wrap(text):
+            lines.append(f"({_pdf_escape(line)}) Tj T*")
+        lines.append("ET")
+        stream = "\n".join(lines).encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_obj, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog, xref
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_scanned_pdf(path, page_texts, resolution=100):
+    """PDF из растровых страниц без текстового слоя (для OCR)."""
+    from PIL import Image, ImageDraw
+
+    width, height = int(8.27 * resolution), int(11.69 * resolution)
+    images = []
+    for text in page_texts:
+        im = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(im)
+        y = 30
+        for line in _wrap(text, width=100):
+            draw.text((30, y), line, fill=0)
+            y += 14
+        images.append(im)
+    images[0].save(path, "PDF", resolution=resolution, save_all=True, append_images=images[1:])
+
+
+def write_docx(path, page_texts):
+    from docx import Document
+
+    doc = Document()
+    for text in page_texts:
+        for paragraph in text.split("\n"):
+            doc.add_paragraph(paragraph)
+    doc.save(path)
+
+
+WRITERS = {
+    "text_pdf": (".pdf", "en", write_text_pdf),
+    "scanned_pdf": (".pdf", "en", write_scanned_pdf),
+    "docx": (".docx", "ru", write_docx),
+}
+
+
+def generate(out_dir, size="small", kinds=tuple(WRITERS), seed=0):
+    """
+    Пишет корпус в out_dir. Возвращает (files, skipped): files —
+    [{"kind", "path", "pages", "sentences"}], skipped — {kind: причина}
+    для типов, зависимости которых не установлены.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    spec = SIZES[size]
+    rng = random.Random(seed)
+    files = []
+    skipped = {}
+    for kind in kinds:
+        ext, lang, writer = WRITERS[kind]
+        for n in range(spec["documents"]):
+            texts = pages(rng, spec["pages"], spec["sentences_per_page"], lang)
+            path = os.path.join(out_dir, f"{kind}_{n}{ext}")
+            try:
+                writer(path, texts)
+            except ImportError as e:
+                skipped[kind] = f"нет зависимости: {e.name}"
+                break
+            files.append({
+                "kind": kind,
+                "path": path,
+                "pages": spec["pages"],
+                "sentences": spec["pages"] * spec["sentences_per_page"],
+            })
+    return files, skipped
+
+
+def text_documents(size="small", seed=0, lang="ru"):
+    """Тексты документов постранично, без файлов (для стадий после чтения)."""
+    spec = SIZES[size]
+    rng = random.Random(seed)
+    return [
+        pages(rng, spec["pages"], spec["sentences_per_page"], lang)
+        for _ in range(spec["documents"])
+    ]
@@ -0,0 +1,395 @@
+# benchmarks/run.py
+"""
+Офлайн-бенчмарк стадий пайплайна и API.
+
+Запуск из папки BACK:
+
+    python -m benchmarks.run --size small --out bench.json
+    python -m benchmarks.compare old.json new.json
+
+Корпус синтетический (benchmarks.corpus), NLP — заглушка (benchmarks.stub_nlp),
+поэтому модели spaCy не нужны. Для каждой стадии — время (медиана по
+--repeat повторам), пропускная способность и пиковая память Python
+(tracemalloc, отдельным прогоном); для API — задержки p50/p95/p99 и RPS.
+Стадии, зависимости которых не установлены (pdfplumber, pytesseract,
+python-docx, Pillow), попадают в результат как skipped.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import corpus
+from benchmarks.stub_nlp import StubNLPProcessor
+
+RESULT_FORMAT = 1
+
+
+# -----------------------------
+# MEASUREMENT
+# -----------------------------
+def measure(name, fn, unit, repeat=3, setup=None, **extra):
+    """
+    fn() выполняет стадию и возвращает число обработанных единиц (unit).
+    setup() — подготовка перед каждым прогоном, в замер не входит.
+    """
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        items = fn()
+        timings.append(time.perf_counter() - started)
+
+    # память — отдельным прогоном: tracemalloc замедляет выполнение
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = statistics.median(timings)
+    result = {
+        "stage": name,
+        "unit": unit,
+        "items": items,
+        "seconds": round(seconds, 6),
+        "seconds_min": round(min(timings), 6),
+        "throughput": round(items / seconds, 2) if seconds > 0 else None,
+        "peak_mb": round(peak / 2 ** 20, 3),
+    }
+    result.update(extra)
+    print(f"  {name:<28} {result['throughput'] or 0:>12.1f} {unit}/s"
+          f"  {seconds * 1000:>9.1f} ms  {result['peak_mb']:>8.2f} MB", file=sys.stderr)
+    return result
+
+
+def skipped(name, reason):
+    print(f"  {name:<28} skipped: {reason}", file=sys.stderr)
+    return {"stage": name, "skipped": reason}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+# -----------------------------
+# STAGES
+# -----------------------------
+def bench_ingest(files, skipped_kinds, args):
+    from ingest import DocumentIngestor
+
+    results = []
+    for kind in corpus.WRITERS:
+        name = f"ingest.{kind}"
+        if kind in skipped_kinds:
+            results.append(skipped(name, skipped_kinds[kind]))
+            continue
+        paths = [f["path"] for f in files if f["kind"] == kind]
+        pages = sum(f["pages"] for f in files if f["kind"] == kind)
+        ingestor = DocumentIngestor(workers=args.ocr_workers, page_timeout=args.page_timeout)
+
+        def run():
+            for path in paths:
+                for _ in ingestor.iter_file(path):
+                    pass
+            return pages
+
+        try:
+            results.append(measure(name, run, "pages", repeat=args.repeat))
+        except ImportError as e:
+            results.append(skipped(name, f"нет зависимости: {e.name}"))
+        except Exception as e:
+            results.append(skipped(name, f"{type(e).__name__}: {e}"))
+        finally:
+            ingestor.close()
+    return results
+
+
+def bench_preprocess(docs, args):
+    from preprocess import TextPreprocessor
+
+    preproc = TextPreprocessor()
+
+    def run():
+        n = 0
+        for pages in docs:
+            for _ in preproc.iter_sentences(pages):
+                n += 1
+        return n
+
+    return [measure("preprocess.iter_sentences", run, "sentences", repeat=args.repeat)]
+
+
+def bench_nlp(docs, args):
+    from nlp_cache import CachedNLPProcessor
+    from preprocess import TextPreprocessor
+
+    preproc = TextPreprocessor()
+    sents = [s for pages in docs for s in preproc.iter_sentences(pages)]
+    stub = StubNLPProcessor(batch_size=args.batch_size)
+    results = [measure(
+        "nlp.stub", lambda: sum(1 for _ in stub.process_sentences(sents)),
+        "sentences", repeat=args.repeat,
+    )]
+
+    holder = {}
+
+    def fresh_cache():
+        holder["nlp"] = CachedNLPProcessor(stub)
+
+    def run_cached():
+        return sum(1 for _ in holder["nlp"].process_sentences(sents))
+
+    result = measure("nlp.stub_cached", run_cached, "sentences",
+                     repeat=args.repeat, setup=fresh_cache)
+    result["hit_rate"] = holder["nlp"].stats()["hitRate"]
+    results.append(result)
+    return results
+
+
+def prepare_db(path, docs, args):
+    """БД с обработанными документами корпуса (заглушка NLP); возвращает их id."""
+    from pipeline import process_document
+    from preprocess import TextPreprocessor
+    from storage import Storage
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    storage = Storage(path)
+    storage.init_db()
+    preproc = TextPreprocessor()
+    nlp = StubNLPProcessor(batch_size=args.batch_size)
+    ids = []
+    for n, pages in enumerate(docs):
+        doc_id = storage.add_document(f"bench_{n}.pdf")
+        process_document(doc_id, iter(pages), preproc, nlp, storage)
+        ids.append(doc_id)
+    storage.close()
+    return ids
+
+
+def bench_storage(docs, workdir, args):
+    db_path = os.path.join(workdir, "bench_storage.sqlite")
+    from preprocess import TextPreprocessor
+
+    preproc = TextPreprocessor()
+    sentences = sum(1 for pages in docs for _ in preproc.iter_sentences(pages))
+
+    def run():
+        prepare_db(db_path, docs, args)
+        return sentences
+
+    return [measure("pipeline.process_document", run, "sentences", repeat=args.repeat)]
+
+
+def bench_export(db_path, workdir, args):
+    import sqlite3
+    from export import JsonLdCache, iter_graphml
+
+    conn = sqlite3.connect(db_path)
+    results = []
+
+    def graphml():
+        return sum(len(chunk) for chunk in iter_graphml(conn))
+
+    size = graphml()
+    results.append(measure("export.graphml", lambda: graphml() / 2 ** 20, "MB",
+                           repeat=args.repeat, bytes=size))
+
+    cache_dir = os.path.join(workdir, "jsonld")
+
+    def cold():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def jsonld():
+        cache = JsonLdCache(cache_dir)
+        return sum(len(chunk) for chunk in cache.iter_export(conn)) / 2 ** 20
+
+    results.append(measure("export.jsonld_cold", jsonld, "MB", repeat=args.repeat, setup=cold))
+    results.append(measure("export.jsonld_cached", jsonld, "MB", repeat=args.repeat))
+    conn.close()
+    return results
+
+
+def api_scenarios(doc_ids):
+    doc = doc_ids[0]
+    return [
+        ("api.graph", f"/graph/{doc}"),
+        ("api.graph_page", f"/graph/{doc}?limit=50"),
+        ("api.graph_compact", f"/graph/{doc}?format=compact"),
+        ("api.entities", "/entities?limit=100"),
+        ("api.entities_search", "/entities?q=Петров"),
+        ("api.neighborhood", "/neighborhood?q=Петров&hops=2"),
+        ("api.stats", "/stats"),
+    ]
+
+
+def bench_api(db_path, doc_ids, args):
+    """Нагрузка на эндпоинты через TestClient: concurrency потоков, requests запросов."""
+    os.environ["DB_PATH"] = db_path
+    os.environ["INPUT_DIR"] = os.path.join(os.path.dirname(db_path), "input_docs")
+    try:
+        from fastapi.testclient import TestClient
+        import app as api
+    except ImportError as e:
+        return [skipped("api", f"нет зависимости: {e.name}")]
+
+    # без lifespan: пул воркеров для запросов на чтение не нужен
+    client = TestClient(api.app)
+    local = threading.local()
+
+    def call(url):
+        c = getattr(local, "client", None)
+        if c is None:
+            c = local.client = TestClient(api.app)
+        started = time.perf_counter()
+        r = c.get(url)
+        elapsed = time.perf_counter() - started
+        if r.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {r.status_code}")
+        return elapsed, len(r.content)
+
+    results = []
+    for name, url in api_scenarios(doc_ids):
+        client.get(url)  # прогрев
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            started = time.perf_counter()
+            samples = list(pool.map(call, [url] * args.requests))
+            wall = time.perf_counter() - started
+        latencies = [s[0] * 1000 for s in samples]
+        result = {
+            "stage": name,
+            "url": url,
+            "unit": "requests",
+            "items": len(samples),
+            "concurrency": args.concurrency,
+            "seconds": round(wall, 6),
+            "throughput": round(len(samples) / wall, 2),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "max": round(max(latencies), 3),
+            },
+            "response_bytes": samples[0][1],
+        }
+        print(f"  {name:<28} {result['throughput']:>12.1f} req/s"
+              f"  p50 {result['latency_ms']['p50']:.1f} ms  p95 {result['latency_ms']['p95']:.1f} ms",
+              file=sys.stderr)
+        results.append(result)
+    return results
+
+
+# -----------------------------
+# MAIN
+# -----------------------------
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+STAGES = ("ingest", "preprocess", "nlp", "storage", "export", "api")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Офлайн-бенчмарк пайплайна и API")
+    p.add_argument("--size", default="small", choices=sorted(corpus.SIZES))
+    p.add_argument("--stages", default=",".join(STAGES),
+                   help=f"Стадии через запятую: {', '.join(STAGES)}")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=3, help="Повторов на стадию (берётся медиана)")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--ocr-workers", type=int, default=1)
+    p.add_argument("--page-timeout", type=int, default=120)
+    p.add_argument("--requests", type=int, default=200, help="Запросов на сценарий API")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--workdir", default=None, help="Папка для корпуса и БД (по умолчанию временная)")
+    p.add_argument("--out", default=None, help="JSON с результатами (по умолчанию stdout)")
+    args = p.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="kb-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    print(f"Бенчмарк: size={args.size}, workdir={workdir}", file=sys.stderr)
+    docs = corpus.text_documents(args.size, seed=args.seed)
+    results = []
+    try:
+        if "ingest" in stages:
+            files, skipped_kinds = corpus.generate(
+                os.path.join(workdir, "corpus"), args.size, seed=args.seed
+            )
+            results += bench_ingest(files, skipped_kinds, args)
+        if "preprocess" in stages:
+            results += bench_preprocess(docs, args)
+        if "nlp" in stages:
+            results += bench_nlp(docs, args)
+        if "storage" in stages:
+            results += bench_storage(docs, workdir, args)
+        if "export" in stages or "api" in stages:
+            db_path = os.path.join(workdir, "bench.sqlite")
+            doc_ids = prepare_db(db_path, docs, args)
+            if "export" in stages:
+                results += bench_export(db_path, workdir, args)
+            if "api" in stages:
+                results += bench_api(db_path, doc_ids, args)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "format": RESULT_FORMAT,
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "size": args.size,
+            "corpus": corpus.SIZES[args.size],
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "batch_size": args.batch_size,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
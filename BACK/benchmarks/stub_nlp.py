@@ -0,0 +1,67 @@
+# benchmarks/stub_nlp.py
+import re
+
+TOKEN = re.compile(r"\w+(?:[-.]\w+)*")
+ORG_PREFIXES = ("ООО", "АО", "Министерство", "Acme", "Globex", "Initech", "Ministry")
+
+
+class StubNLPProcessor:
+    """
+    Заглушка NLPProcessor для бенчмарков: тот же интерфейс, без spaCy.
+
+    Сущности — последовательности слов с заглавной буквы, отношение —
+    (первая сущность, следующее за ней слово, вторая сущность). Результат
+    детерминирован, поэтому стадии после NLP (запись, экспорт, API)
+    измеряются на данных, похожих на реальные, без загрузки моделей.
+    """
+
+    def __init__(self, lang_preference="ru", batch_size=64, n_process=1):
+        self.lang = lang_preference
+        self.default_lang = "ru" if lang_preference == "auto" else lang_preference
+        self.batch_size = batch_size
+        self.n_process = n_process
+
+    def preload(self):
+        pass
+
+    def route(self, text):
+        return self.default_lang
+
+    def model_id(self, lang):
+        return f"stub:{lang}"
+
+    def process_sentence(self, sent_text):
+        ents = []
+        current = None
+        for m in TOKEN.finditer(sent_text):
+            word = m.group()
+            if word[:1].isupper():
+                if current is not None and current["end_char"] + 1 == m.start():
+                    current["end_char"] = m.end()
+                    current["text"] = sent_text[current["start_char"]:m.end()]
+                    continue
+                label = "ORG" if word.startswith(ORG_PREFIXES) else "PER"
+                current = {"text": word, "label": label,
+                           "start_char": m.start(), "end_char": m.end()}
+                ents.append(current)
+            else:
+                current = None
+
+        relations = []
+        if len(ents) >= 2:
+            subj, obj = ents[0], ents[1]
+            between = TOKEN.search(sent_text, subj["end_char"], obj["start_char"])
+            relations.append({
+                "subj": subj["text"],
+                "pred": between.group().lower() if between else "связан",
+                "obj": obj["text"],
+                "subj_start": subj["start_char"],
+                "subj_end": subj["end_char"],
+                "obj_start": obj["start_char"],
+                "obj_end": obj["end_char"],
+            })
+        return ents, relations
+
+    def process_sentences(self, sents, batch_size=None, n_process=None):
+        for sent in sents:
+            yield self.process_sentence(sent)
@@ -0,0 +1,134 @@
+# db_pool.py
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from storage import PRAGMAS
+
+# соединения пула только читают; mmap ускоряет чтение больших БД
+READ_PRAGMAS = PRAGMAS + (
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA query_only=ON",
+)
+
+# подготовленных выражений на соединение: sqlite3 кэширует их по тексту SQL,
+# поэтому запросы API с постоянным текстом не компилируются повторно
+STATEMENT_CACHE = 256
+
+
+class PoolTimeout(Exception):
+    """Все соединения пула заняты дольше timeout секунд."""
+
+
+class ConnectionPool:
+    """
+    Пул соединений SQLite для чтения.
+
+    Соединения открываются по мере нужды, но не больше size, и возвращаются
+    в пул после запроса: кэш страниц и подготовленных выражений
+    переиспользуется, файловые дескрипторы не копятся. Свободные выдаются
+    в порядке LIFO — последним использованное соединение самое «тёплое».
+    Соединение используется одним запросом за раз, но разными потоками
+    (обработчик и потоковый ответ), поэтому check_same_thread=False.
+    """
+
+    def __init__(self, db_path, size=16, timeout=30):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._open()
+            except BaseException:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"Нет свободного соединения с БД за {self.timeout} с")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Закрывает свободные соединения; занятые вернутся в пул и откроются заново."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self):
+        return {"size": self.size, "open": self._opened, "idle": self._idle.qsize()}
+
+
+class DbWriter:
+    """
+    Единственное соединение записи API. Транзакции выполняются по одной
+    (блокировка), поэтому запросы API не конкурируют друг с другом за
+    блокировку записи SQLite; воркеры извлечения пишут своими соединениями.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция BEGIN IMMEDIATE; при исключении — откат."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(
+                    self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE
+                )
+                self._conn.row_factory = sqlite3.Row
+                for pragma in PRAGMAS:
+                    self._conn.execute(pragma)
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                yield self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
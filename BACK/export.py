@@ -0,0 +1,236 @@
+# export.py
+import hashlib
+import json
+import os
+import re
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+# символы, недопустимые в XML 1.0 (встречаются в тексте после OCR)
+INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# размер порции, которой отдаётся поток
+CHUNK_SIZE = 64 * 1024
+
+GRAPHML_HEADER = """<?xml version='1.0' encoding='utf-8'?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns \
+http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+  <key id="d0" for="node" attr.name="type" attr.type="string"/>
+  <key id="d1" for="node" attr.name="text" attr.type="string"/>
+  <key id="d2" for="node" attr.name="label" attr.type="string"/>
+  <key id="d3" for="node" attr.name="document_id" attr.type="long"/>
+  <key id="d4" for="edge" attr.name="edge_type" attr.type="string"/>
+  <graph edgedefault="directed">
+"""
+
+GRAPHML_FOOTER = """  </graph>
+</graphml>
+"""
+
+NODE_KEYS = (("type", "d0"), ("text", "d1"), ("label", "d2"), ("document_id", "d3"))
+
+
+def _xml_text(value):
+    return escape(INVALID_XML_CHARS.sub("", str(value)))
+
+
+def _node(node_id, **attrs):
+    parts = [f"    <node id={quoteattr(node_id)}>"]
+    for name, key in NODE_KEYS:
+        value = attrs.get(name)
+        if value is not None:
+            parts.append(f'<data key="{key}">{_xml_text(value)}</data>')
+    parts.append("</node>\n")
+    return "".join(parts)
+
+
+def _edge(source, target, edge_type):
+    return (
+        f"    <edge source={quoteattr(source)} target={quoteattr(target)}>"
+        f'<data key="d4">{edge_type}</data></edge>\n'
+    )
+
+
+def chunked(pieces):
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf)
+
+
+def iter_graphml(conn, document_id=None):
+    """
+    Потоковый GraphML: узлы и рёбра пишутся прямо из курсоров, без построения
+    графа в памяти. Если document_id=None — экспортируется весь корпус.
+    Возвращает генератор строковых порций.
+    """
+    return chunked(_graphml_pieces(conn, document_id))
+
+
+def _graphml_pieces(conn, document_id):
+    if document_id:
+        doc_filter = "WHERE document_id = ?"
+        params = (document_id,)
+    else:
+        doc_filter = ""
+        params = ()
+
+    yield GRAPHML_HEADER
+
+    # Узлы: предложения
+    for sid, docid, text in conn.execute(
+        f"SELECT id, document_id, text FROM sentences {doc_filter}", params
+    ):
+        yield _node(f"sent_{sid}", type="sentence", text=text, document_id=docid)
+
+    # Узлы: сущности
+    for eid, docid, text, label in conn.execute(
+        f"SELECT id, document_id, text, label FROM entities {doc_filter}", params
+    ):
+        yield _node(f"ent_{eid}", type="entity", label=label, text=text, document_id=docid)
+
+    # Узлы и рёбра отношений (сущности subj/obj связаны при записи документа)
+    for rid, docid, pred, sid, subj_eid, obj_eid in conn.execute(f"""
+        SELECT id, document_id, pred, sentence_id, subj_entity_id, obj_entity_id
+        FROM relations {doc_filter}
+    """, params):
+        yield _node(f"rel_{rid}", type="relation", label=pred, document_id=docid)
+        if subj_eid:
+            yield _edge(f"ent_{subj_eid}", f"rel_{rid}", "subj")
+        if obj_eid:
+            yield _edge(f"rel_{rid}", f"ent_{obj_eid}", "obj")
+        yield _edge(f"sent_{sid}", f"rel_{rid}", "context")
+
+    yield GRAPHML_FOOTER
+
+
+# -----------------------------
+# JSON-LD
+# -----------------------------
+JSONLD_HEADER = '{"@context": {}, "@graph": ['
+JSONLD_FOOTER = ']}\n'
+
+
+def jsonld_cache_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "cache", "jsonld")
+
+
+class JsonLdCache:
+    """
+    Кэш JSON-LD фрагментов по документам: <cache_dir>/<doc_id>.jsonld.
+
+    Фрагмент — элементы @graph одного документа через запятую, без скобок,
+    поэтому полный экспорт — это конкатенация фрагментов, а не пересборка
+    всего корпуса. Фрагмент создаётся, когда документ обработан, и удаляется
+    при удалении или переобработке документа.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, doc_id):
+        return os.path.join(self.cache_dir, f"{int(doc_id)}.jsonld")
+
+    def invalidate(self, doc_id):
+        try:
+            os.remove(self.path(doc_id))
+        except FileNotFoundError:
+            pass
+
+    def build(self, conn, doc_id):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(doc_id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            first = True
+            for item in _jsonld_items(conn, doc_id):
+                if not first:
+                    f.write(",")
+                f.write(json.dumps(item, ensure_ascii=False))
+                first = False
+        # атомарная замена: читатели видят либо старый, либо новый фрагмент
+        os.replace(tmp, path)
+        return path
+
+    def _documents(self, conn, document_id=None):
+        if document_id:
+            rows = conn.execute(
+                "SELECT id FROM documents WHERE id=? AND status='completed'", (document_id,)
+            )
+        else:
+            rows = conn.execute("SELECT id FROM documents WHERE status='completed' ORDER BY id")
+        return [r[0] for r in rows]
+
+    def _fragments(self, conn, document_id=None):
+        """[(doc_id, path, stat)] фрагментов в области экспорта; недостающие строятся."""
+        fragments = []
+        for doc_id in self._documents(conn, document_id):
+            path = self.path(doc_id)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = os.stat(self.build(conn, doc_id))
+            fragments.append((doc_id, path, st))
+        return fragments
+
+    def etag(self, conn, document_id=None):
+        h = hashlib.sha1()
+        for doc_id, _, st in self._fragments(conn, document_id):
+            h.update(f"{doc_id}:{st.st_size}:{st.st_mtime_ns};".encode())
+        return f'"{h.hexdigest()}"'
+
+    def iter_export(self, conn, document_id=None):
+        """Потоковая склейка фрагментов в один JSON-LD документ."""
+        yield JSONLD_HEADER
+        first = True
+        for doc_id, path, st in self._fragments(conn, document_id):
+            if st.st_size == 0:
+                continue
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                # фрагмент инвалидирован во время отдачи
+                continue
+            with f:
+                if not first:
+                    yield ","
+                first = False
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), ""):
+                    yield chunk
+        yield JSONLD_FOOTER
+
+
+def _jsonld_items(conn, doc_id):
+    # Сущности
+    for eid, text, label in conn.execute(
+        "SELECT id, text, label FROM entities WHERE document_id=? ORDER BY id", (doc_id,)
+    ):
+        yield {
+            "@id": f"entity/{eid}",
+            "type": "Entity",
+            "document": doc_id,
+            "text": text,
+            "label": label,
+        }
+
+    # Отношения
+    for rid, subj, pred, obj in conn.execute(
+        "SELECT id, subj, pred, obj FROM relations WHERE document_id=? ORDER BY id", (doc_id,)
+    ):
+        yield {
+            "@id": f"relation/{rid}",
+            "type": "Relation",
+            "document": doc_id,
+            "subj": subj,
+            "pred": pred,
+            "obj": obj,
+        }
@@ -0,0 +1,120 @@
+# graph_cache.py
+import glob
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+# ответы сжимаются один раз при записи в кэш, уровень — компромисс
+# между временем первого запроса и размером
+GZIP_LEVEL = 6
+
+
+def graph_cache_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "cache", "graph")
+
+
+class GraphCache:
+    """
+    Кэш ответов /graph/{doc_id}: полный граф обработанного документа
+    в каждом формате (json, compact), сжатый gzip.
+
+    Граф документа не меняется до переобработки или удаления, поэтому
+    ответ строится один раз. Ключ включает версию графа (диапазон id
+    предложений документа, он меняется при переобработке): запись,
+    устаревшая после переобработки в другом процессе, просто не находится.
+    invalidate удаляет записи документа при удалении и переобработке.
+    Первый уровень — LRU в памяти, ограниченный по байтам, второй (если
+    задан cache_dir) — файлы <cache_dir>/<doc_id>.<версия>.<формат>.gz.
+    """
+
+    def __init__(self, cache_dir=None, memory_bytes=DEFAULT_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def path(self, doc_id, version, fmt):
+        return os.path.join(self.cache_dir, f"{int(doc_id)}.{version}.{fmt}.gz")
+
+    def get(self, doc_id, version, fmt):
+        """Сжатый ответ или None."""
+        key = (int(doc_id), version, fmt)
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return body
+
+        if self.cache_dir:
+            try:
+                with open(self.path(*key), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                self._remember(key, body)
+                with self._lock:
+                    self.disk_hits += 1
+                return body
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, doc_id, version, fmt, data):
+        """Сжимает data (bytes) и сохраняет; возвращает сжатый ответ."""
+        key = (int(doc_id), version, fmt)
+        body = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        self._remember(key, body)
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.path(*key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+        return body
+
+    def _remember(self, key, body):
+        if len(body) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._memory[key] = body
+            self._size += len(body)
+            while self._size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, doc_id):
+        doc_id = int(doc_id)
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == doc_id]:
+                self._size -= len(self._memory.pop(key))
+
+        if self.cache_dir:
+            for path in glob.glob(os.path.join(self.cache_dir, f"{doc_id}.*.gz")):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "memoryEntries": len(self._memory),
+                "memoryBytes": self._size,
+            }
@@ -1,66 +1,283 @@
 # ingest.py
 import os
-import pdfplumber
-from docx import Document
-from PIL import Image
-import pytesseract
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import metrics
 from utils import log
+from manifest import NEW, CHANGED, DUPLICATE
+from ocr_cache import OcrCache, image_key, DEFAULT_MAX_BYTES
 
 SUPPORTED = ('.pdf', '.docx')
 
+# pdfplumber, python-docx, Pillow и pytesseract импортируются при первом
+# чтении файла соответствующего типа: API и CLI стартуют без них
+
+OCR_RESOLUTION = 150
+
+# документы короче этого читаются в текущем процессе: пул не окупается
+PARALLEL_MIN_PAGES = 8
+
+
+def _page_text(page, ocr_lang, timeout, cache=None):
+    """
+    (текст, секунды разбора, секунды OCR или None) — время возвращается
+    вместе с текстом, потому что страница может читаться в процессе пула.
+    """
+    started = time.perf_counter()
+    ptext = page.extract_text()
+    parsed = time.perf_counter()
+    if ptext:
+        return ptext, parsed - started, None
+    # если текст пуст — пробуем raster -> OCR
+    im = page.to_image(resolution=OCR_RESOLUTION).original
+    text = _ocr_image(im, ocr_lang, timeout, cache, OCR_RESOLUTION, f"страницы {page.page_number}")
+    return text, parsed - started, time.perf_counter() - parsed
+
+
+def _record_page(timings, parse_seconds, ocr_seconds):
+    timings.add("pdf_parse", parse_seconds, count=1)
+    metrics.observe("kb_page_seconds", parse_seconds, step="parse")
+    if ocr_seconds is None:
+        metrics.inc("kb_pdf_pages_total", ocr="0")
+        return
+    timings.add("ocr", ocr_seconds, count=1)
+    metrics.observe("kb_page_seconds", ocr_seconds, step="ocr")
+    metrics.inc("kb_pdf_pages_total", ocr="1")
+
+
+def _ocr_image(im, ocr_lang, timeout, cache=None, resolution=None, what="изображения"):
+    key = None
+    if cache is not None:
+        key = image_key(im, ocr_lang, resolution)
+        text = cache.get(key)
+        if text is not None:
+            return text
+    import pytesseract
+
+    try:
+        text = pytesseract.image_to_string(im, lang=ocr_lang, timeout=timeout)
+    except pytesseract.TesseractError:
+        raise
+    except RuntimeError as e:
+        # pytesseract прерывает распознавание по таймауту через RuntimeError;
+        # прерванный результат не кэшируется
+        log(f"OCR {what} прерван: {e}")
+        return ""
+    if key is not None:
+        cache.put(key, text)
+    return text
+
+
+# открытый PDF в процессе пула: страницы одного файла идут подряд,
+# поэтому файл не переоткрывается для каждой страницы
+_worker_pdf = None
+_worker_cache = None
+
+
+def _extract_page(path, index, ocr_lang, timeout, cache_path=None, cache_max_bytes=None):
+    """Текст одной страницы и время её чтения (_page_text); выполняется в процессе пула."""
+    import pdfplumber
+
+    global _worker_pdf, _worker_cache
+    if cache_path and (_worker_cache is None or _worker_cache.path != cache_path):
+        _worker_cache = OcrCache(cache_path, cache_max_bytes)
+    key = (path, os.path.getmtime(path))
+    if _worker_pdf is None or _worker_pdf[0] != key:
+        if _worker_pdf is not None:
+            _worker_pdf[1].close()
+        _worker_pdf = (key, pdfplumber.open(path))
+    page = _worker_pdf[1].pages[index]
+    try:
+        return _page_text(page, ocr_lang, timeout, _worker_cache if cache_path else None)
+    finally:
+        # освобождаем разобранные объекты страницы (close — pdfplumber>=0.10)
+        release = getattr(page, "close", None) or getattr(page, "flush_cache", None)
+        if release:
+            release()
+
+
 class DocumentIngestor:
-    def __init__(self, ocr_lang='rus+eng'):
+    def __init__(self, ocr_lang='rus+eng', workers=None, page_timeout=120,
+                 cache_path=None, cache_max_bytes=DEFAULT_MAX_BYTES):
+        """
+        workers — число процессов для постраничного извлечения текста и OCR
+        (по умолчанию по числу ядер, 1 — без пула); page_timeout — лимит
+        в секундах на страницу, после которого страница пропускается.
+        cache_path — файл кэша OCR (ocr_cache.OcrCache), None — без кэша.
+        """
         self.ocr_lang = ocr_lang
+        self.workers = workers or os.cpu_count() or 1
+        self.page_timeout = page_timeout
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self.cache = OcrCache(cache_path, cache_max_bytes) if cache_path else None
+        self._pool = None
 
-    def ingest_folder(self, folder):
-        results = []
+    def _executor(self):
+        # пул создаётся при первом большом PDF и переиспользуется;
+        # spawn — потому что ingestor работает и в многопоточном API
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self.cache is not None:
+            self.cache.close()
+
+    def scan_folder(self, folder, manifest=None):
+        """
+        Поддерживаемые файлы папки к обработке: dict с path, file и document_id.
+        Если передан manifest (FileManifest), выдаются только новые и изменённые
+        файлы; для изменённых document_id — id существующего документа.
+        """
+        skipped = 0
         for root, _, files in os.walk(folder):
             for fname in files:
                 if fname.lower().endswith(SUPPORTED):
                     path = os.path.join(root, fname)
                     try:
-                        text = self.read_file(path)
-                        results.append({'path': path, 'text': text})
-                        log(f"Прочитан: {path}")
+                        info = None
+                        if manifest is not None:
+                            state, info = manifest.check(path)
+                            if state == DUPLICATE:
+                                log(f"Дубликат содержимого, привязан к документу {info['document_id']}: {path}")
+                            if state not in (NEW, CHANGED):
+                                skipped += 1
+                                continue
                     except Exception as e:
                         log(f"Ошибка при чтении {path}: {e}")
+                        continue
+                    yield {
+                        'path': path,
+                        'file': info,
+                        'document_id': info['document_id'] if info else None,
+                    }
+        if skipped:
+            log(f"Пропущено без изменений: {skipped}")
+
+    def ingest_folder(self, folder, manifest=None):
+        """Как scan_folder, но с прочитанным текстом каждого файла (ключ text)."""
+        results = []
+        for meta in self.scan_folder(folder, manifest):
+            try:
+                meta['text'] = self.read_file(meta['path'])
+                results.append(meta)
+                log(f"Прочитан: {meta['path']}")
+            except Exception as e:
+                log(f"Ошибка при чтении {meta['path']}: {e}")
         return results
 
-    def read_file(self, path):
+    def read_file(self, path, progress=None):
+        """progress(pages_done=..., pages_total=...) вызывается по мере чтения PDF."""
+        return "\n".join(self.iter_file(path, progress))
+
+    def iter_file(self, path, progress=None, timings=metrics.NULL_TIMINGS):
+        """
+        Текст файла частями по порядку: страницы PDF, абзацы DOCX.
+        Части выдаются по мере чтения, весь текст в памяти не собирается.
+        timings (metrics.StageTimings) получает время разбора страниц и OCR.
+        """
         ext = os.path.splitext(path)[1].lower()
         if ext == '.pdf':
-            return self._read_pdf(path)
+            return self._iter_pdf(path, progress, timings)
         elif ext == '.docx':
-            return self._read_docx(path)
+            return self._iter_docx(path)
         else:
             raise ValueError("Unsupported format")
 
-    def _read_pdf(self, path):
-        text_parts = []
+    def _iter_pdf(self, path, progress=None, timings=metrics.NULL_TIMINGS):
+        import pdfplumber
+
+        emitted = False
         try:
             with pdfplumber.open(path) as pdf:
-                for page in pdf.pages:
-                    ptext = page.extract_text()
-                    if ptext:
-                        text_parts.append(ptext)
-                    else:
-                        # если текст пуст — пробуем raster -> OCR
-                        im = page.to_image(resolution=150).original
-                        ocr_text = pytesseract.image_to_string(im, lang=self.ocr_lang)
-                        text_parts.append(ocr_text)
+                total = len(pdf.pages)
+                parallel = self.workers > 1 and total >= PARALLEL_MIN_PAGES
+                if not parallel:
+                    for i, page in enumerate(pdf.pages):
+                        if progress:
+                            progress(pages_done=i, pages_total=total)
+                        text, parse, ocr = _page_text(page, self.ocr_lang, self.page_timeout, self.cache)
+                        _record_page(timings, parse, ocr)
+                        emitted = True
+                        yield text
+            if parallel:
+                for text in self._iter_pdf_parallel(path, total, progress, timings):
+                    emitted = True
+                    yield text
+            if progress:
+                progress(pages_done=total, pages_total=total)
         except Exception as e:
+            if emitted:
+                # часть страниц уже передана дальше — полный OCR их бы задублировал
+                raise
             log(f"pdfplumber failed, fallback to full OCR for {path}: {e}")
-            return self._read_image(path)
-        return "\n".join(text_parts)
+            started = time.perf_counter()
+            text = self._read_image(path)
+            timings.add("ocr", time.perf_counter() - started, count=1)
+            yield text
+
+    def _iter_pdf_parallel(self, path, total, progress=None, timings=metrics.NULL_TIMINGS):
+        """
+        Страницы распределяются по процессам пула, текст выдаётся в порядке
+        страниц. В работе не больше 2 * workers страниц, поэтому готовые
+        результаты не накапливаются, если потребитель медленнее пула.
+        """
+        pool = self._executor()
+        window = deque()
+        submitted = 0
+
+        def submit_more():
+            nonlocal submitted
+            while submitted < total and len(window) < self.workers * 2:
+                window.append(pool.submit(
+                    _extract_page, path, submitted, self.ocr_lang, self.page_timeout,
+                    self.cache_path, self.cache_max_bytes,
+                ))
+                submitted += 1
+
+        submit_more()
+        i = 0
+        try:
+            while window:
+                fut = window.popleft()
+                if progress:
+                    progress(pages_done=i, pages_total=total)
+                try:
+                    # запас сверх таймаута OCR на растеризацию и разбор страницы
+                    text, parse, ocr = fut.result(timeout=self.page_timeout * 2)
+                    _record_page(timings, parse, ocr)
+                except FutureTimeout:
+                    fut.cancel()
+                    log(f"Страница {i + 1} {path} не обработана за {self.page_timeout * 2} с, пропущена")
+                    text = ""
+                except Exception as e:
+                    log(f"Ошибка чтения страницы {i + 1} {path}: {e}")
+                    text = ""
+                submit_more()
+                i += 1
+                yield text
+        finally:
+            for fut in window:
+                fut.cancel()
+
+    def _iter_docx(self, path):
+        from docx import Document
 
-    def _read_docx(self, path):
         doc = Document(path)
-        full = []
         for p in doc.paragraphs:
-            full.append(p.text)
-        return "\n".join(full)
+            yield p.text
 
     def _read_image(self, path):
+        from PIL import Image
+
         img = Image.open(path)
-        text = pytesseract.image_to_string(img, lang=self.ocr_lang)
-        return text
+        return _ocr_image(img, self.ocr_lang, self.page_timeout, self.cache)
@@ -0,0 +1,228 @@
+# jobs.py
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from storage import PRAGMAS
+
+# чем больше, тем раньше задание берётся в работу:
+# свежие загрузки идут впереди переобработки уже имеющихся документов
+PRIORITY_UPLOAD = 10
+PRIORITY_REPROCESS = 0
+
+JOB_COLUMNS = """
+    id, kind, priority, status, document_id, path, filename, file_info, duplicate,
+    pages_done, pages_total, sentences_done, sentences_total, error, version,
+    created_at, started_at, finished_at
+"""
+
+
+class QueueFull(Exception):
+    """В очереди уже max_queued заданий — новое не принимается."""
+
+
+class JobActive(Exception):
+    """У документа уже есть задание в очереди или в работе (job)."""
+
+    def __init__(self, job):
+        super().__init__(f"Документ {job['document_id']} уже обрабатывается: задание {job['id']}")
+        self.job = job
+
+
+class JobQueue:
+    """
+    Персистентная очередь заданий извлечения (таблица jobs в БД).
+
+    Задания переживают перезапуск: незавершённые при старте возвращаются
+    в очередь (recover). Порядок выборки — priority DESC, затем время
+    постановки. Прогресс (страницы, предложения) пишется в ту же строку,
+    version увеличивается при каждом изменении — по нему клиенты
+    long-poll/SSE понимают, что состояние обновилось.
+
+    Методы постановки и чтения принимают conn — соединение с уже открытой
+    транзакцией (DbWriter API или пул чтения); без него используется
+    соединение текущего потока.
+    """
+
+    def __init__(self, db_path, max_queued=100):
+        self.db_path = db_path
+        self.max_queued = max_queued
+        self._local = threading.local()
+        self._cond = threading.Condition()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    # -----------------------------
+    # PRODUCER
+    # -----------------------------
+    def enqueue(self, kind, document_id, path, filename, priority, file_info=None, conn=None):
+        """
+        С conn задание вставляется в транзакцию вызывающего, и воркеры
+        будятся только после её фиксации — вызывающий вызывает notify.
+        """
+        if conn is not None:
+            return self._insert(conn, kind, document_id, path, filename, priority, file_info)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            job = self._insert(conn, kind, document_id, path, filename, priority, file_info)
+        self.notify()
+        return job
+
+    def _insert(self, conn, kind, document_id, path, filename, priority, file_info):
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued'").fetchone()[0]
+        if queued >= self.max_queued:
+            raise QueueFull(f"Очередь заполнена: {queued} заданий")
+        job_id = uuid.uuid4().hex
+        conn.execute("""
+            INSERT INTO jobs(id, kind, priority, status, document_id, path, filename,
+                             file_info, created_at)
+            VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+        """, (job_id, kind, priority, document_id, path, filename,
+              json.dumps(file_info) if file_info else None, _now()))
+        return self.get(job_id, conn=conn)
+
+    def record_completed(self, kind, document_id, path, filename, duplicate=False, conn=None):
+        """Задание, которое не требует обработки (например, дубликат содержимого)."""
+        job_id = uuid.uuid4().hex
+        now = _now()
+        sql = """
+            INSERT INTO jobs(id, kind, priority, status, document_id, path, filename,
+                             duplicate, created_at, started_at, finished_at)
+            VALUES (?, ?, 0, 'completed', ?, ?, ?, ?, ?, ?, ?)
+        """
+        params = (job_id, kind, document_id, path, filename, int(duplicate), now, now, now)
+        if conn is not None:
+            conn.execute(sql, params)
+        else:
+            conn = self._conn()
+            with conn:
+                conn.execute(sql, params)
+        return self.get(job_id, conn=conn)
+
+    def notify(self):
+        """Будит один воркер: в очереди появилось задание."""
+        with self._cond:
+            self._cond.notify()
+
+    # -----------------------------
+    # CONSUMER
+    # -----------------------------
+    def claim(self, timeout=None):
+        """
+        Забирает следующее задание (status -> running) или возвращает None,
+        если за timeout секунд ничего не появилось.
+        """
+        job = self._claim()
+        if job is None and timeout:
+            with self._cond:
+                self._cond.wait(timeout)
+            job = self._claim()
+        return job
+
+    def _claim(self):
+        conn = self._conn()
+        with conn:
+            row = conn.execute(f"""
+                UPDATE jobs SET status='running', started_at=?, version=version+1
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status='queued'
+                    ORDER BY priority DESC, created_at
+                    LIMIT 1
+                )
+                RETURNING {JOB_COLUMNS}
+            """, (_now(),)).fetchone()
+        return dict(row) if row else None
+
+    def progress(self, job_id, **fields):
+        """fields — pages_done, pages_total, sentences_done, sentences_total."""
+        sets = ", ".join(f"{k}=?" for k in fields)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET {sets}, version=version+1 WHERE id=?",
+                (*fields.values(), job_id)
+            )
+
+    def finish(self, job_id, status, error=None):
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                UPDATE jobs SET status=?, error=?, finished_at=?, version=version+1
+                WHERE id=?
+            """, (status, error, _now(), job_id))
+
+    def recover(self):
+        """Возвращает в очередь задания, прерванные остановкой процесса."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("""
+                UPDATE jobs SET status='queued', started_at=NULL, version=version+1
+                WHERE status='running'
+            """)
+        return cur.rowcount
+
+    def wakeup(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    # -----------------------------
+    # READ
+    # -----------------------------
+    def active(self, document_id, conn=None):
+        """Задание документа в очереди или в работе, если оно есть."""
+        row = (conn or self._conn()).execute(f"""
+            SELECT {JOB_COLUMNS} FROM jobs
+            WHERE document_id=? AND status IN ('queued', 'running')
+            LIMIT 1
+        """, (document_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get(self, job_id, conn=None):
+        row = (conn or self._conn()).execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE id=?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def job_view(job):
+    """Представление задания для API."""
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "documentId": job["document_id"],
+        "filename": job["filename"],
+        "duplicate": bool(job["duplicate"]),
+        "progress": {
+            "pagesDone": job["pages_done"],
+            "pagesTotal": job["pages_total"],
+            "sentencesDone": job["sentences_done"],
+            "sentencesTotal": job["sentences_total"],
+        },
+        "error": job["error"],
+        "version": job["version"],
+        "createdAt": job["created_at"],
+        "startedAt": job["started_at"],
+        "finishedAt": job["finished_at"],
+    }
+
+
+def _now():
+    return datetime.utcnow().isoformat()
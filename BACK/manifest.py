@@ -0,0 +1,82 @@
+# manifest.py
+import hashlib
+import os
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+DUPLICATE = "duplicate"
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileManifest:
+    """
+    Манифест обработанных файлов (таблица files в БД).
+
+    Перед чтением документа сверяет размер и mtime с манифестом: совпали —
+    файл пропускается без чтения. Иначе считается хэш содержимого; если такое
+    содержимое уже извлечено под другим именем, путь привязывается к
+    существующему документу вместо повторного извлечения.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def check(self, path, sha256=None):
+        """
+        Возвращает (state, info), где info — dict с path, size, mtime_ns,
+        sha256 и document_id (id существующего документа, если он есть).
+        sha256 — хэш содержимого, если он уже посчитан (загрузка через API).
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        info = {
+            "path": path,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": None,
+            "document_id": None,
+        }
+
+        row = self.storage.get_file(path)
+        if row and row[1] == st.st_size and row[2] == st.st_mtime_ns:
+            info["sha256"] = row[3]
+            info["document_id"] = row[4]
+            return UNCHANGED, info
+
+        info["sha256"] = sha256 or file_sha256(path)
+
+        if row and row[3] == info["sha256"]:
+            # содержимое то же, изменился только mtime
+            info["document_id"] = row[4]
+            self.record(info)
+            return UNCHANGED, info
+
+        dup = self.storage.find_file_by_hash(info["sha256"])
+        if dup and dup[4] is not None:
+            info["document_id"] = dup[4]
+            self.record(info)
+            return DUPLICATE, info
+
+        if row and not self.storage.count_linked_files(row[4], path):
+            info["document_id"] = row[4]
+            return CHANGED, info
+        # изменился файл, к документу которого привязаны другие пути:
+        # старый документ остаётся за ними, новое содержимое — новый документ
+        return NEW, info
+
+    def record(self, info, doc_id=None):
+        if doc_id is not None:
+            info["document_id"] = doc_id
+        self.storage.upsert_file(
+            info["path"], info["size"], info["mtime_ns"], info["sha256"], info["document_id"]
+        )
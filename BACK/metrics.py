@@ -0,0 +1,313 @@
+# metrics.py
+"""
+Метрики процесса: счётчики и гистограммы длительностей, выдаются
+в текстовом формате Prometheus (GET /metrics).
+
+METRICS=0 выключает сбор: inc/observe сразу возвращаются, timer и
+stage_timings отдают общие пустые объекты, итераторы не оборачиваются.
+"""
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+ENABLED = os.environ.get("METRICS", "1") == "1"
+
+# границы гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# описания для # HELP
+DESCRIPTIONS = {
+    "kb_http_requests_total": "HTTP-запросы по маршруту и коду ответа",
+    "kb_http_request_seconds": "Время обработки HTTP-запроса до начала ответа",
+    "kb_documents_total": "Обработанные документы по статусу",
+    "kb_document_stage_seconds": "Время стадий обработки документа",
+    "kb_sentences_total": "Предложения, записанные в БД",
+    "kb_entities_total": "Сущности, записанные в БД",
+    "kb_pdf_pages_total": "Прочитанные страницы PDF (ocr=1 — через OCR)",
+    "kb_page_seconds": "Разбор страницы PDF и OCR (step)",
+    "kb_nlp_sentences_total": "Предложения, прошедшие через модель spaCy",
+    "kb_nlp_model_load_seconds": "Загрузка модели spaCy",
+    "kb_db_write_batch_seconds": "Транзакция записи пакета предложений",
+}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    """Значения метрик процесса; методы потокобезопасны."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [счётчики по границам, сумма, количество]
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _key(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            help_text = DESCRIPTIONS.get(name, name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            describe(name, "histogram")
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    if ENABLED:
+        REGISTRY.observe(name, seconds, **labels)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+_NULL = nullcontext()
+
+
+def timer(name, **labels):
+    """with timer("kb_..._seconds"): ... — длительность блока в гистограмму."""
+    if not ENABLED:
+        return _NULL
+    return _Timer(name, labels)
+
+
+def render():
+    return REGISTRY.render()
+
+
+# -----------------------------
+# DOCUMENT STAGES
+# -----------------------------
+class StageTimings:
+    """
+    Время стадий обработки одного документа, секунды.
+
+    Стадии пайплайна связаны генераторами и выполняются вперемешку, поэтому
+    время считается эксклюзивно: next() стадии nlp, который внутри тянет
+    предложения из segment, не включает время segment. Вложенность
+    отслеживается отдельно в каждом потоке (чтение идёт в потоке prefetch).
+    add() — готовые длительности (например, разбор страниц и OCR из процессов
+    пула: это суммарное время процессов, оно может превышать время документа).
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds, count=0):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            if count:
+                self.counts[stage] = self.counts.get(stage, 0) + count
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def iter(self, name, items):
+        """Итератор items, время каждого next() относится к стадии name."""
+        it = iter(items)
+        stage = _Stage(self, name)
+        try:
+            while True:
+                with stage:
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            close = getattr(it, "close", None)
+            if close:
+                close()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def as_dict(self):
+        """{"total": с, "stages": {стадия: с}, "counts": {стадия: n}}."""
+        with self._lock:
+            return {
+                "total": round(time.perf_counter() - self.started, 4),
+                "stages": {k: round(v, 4) for k, v in self.seconds.items()},
+                "counts": dict(self.counts),
+            }
+
+
+class _Stage:
+    __slots__ = ("timings", "name")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        # [начало, время вложенных стадий]
+        self.timings._stack().append([time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, *exc):
+        stack = self.timings._stack()
+        started, nested = stack.pop()
+        elapsed = time.perf_counter() - started
+        if stack:
+            stack[-1][1] += elapsed
+        self.timings.add(self.name, elapsed - nested)
+        return False
+
+
+class _NullStageTimings:
+    def add(self, stage, seconds, count=0):
+        pass
+
+    def stage(self, name):
+        return _NULL
+
+    def iter(self, name, items):
+        return items
+
+    def as_dict(self):
+        return None
+
+
+NULL_TIMINGS = _NullStageTimings()
+
+
+def stage_timings():
+    """StageTimings для документа; при выключенных метриках — пустой объект."""
+    return StageTimings() if ENABLED else NULL_TIMINGS
+
+
+def record_document(stages):
+    """Обработанный документ; stages — StageTimings.as_dict() или None."""
+    inc("kb_documents_total", status="completed")
+    if not stages:
+        return
+    for stage, seconds in stages["stages"].items():
+        observe("kb_document_stage_seconds", seconds, stage=stage)
+    observe("kb_document_stage_seconds", stages["total"], stage="total")
+
+
+# -----------------------------
+# HTTP
+# -----------------------------
+class HttpMetricsMiddleware:
+    """
+    ASGI-middleware: число запросов и время до начала ответа по шаблону
+    маршрута (/graph/{doc_id}, а не /graph/42). Потоковые ответы не
+    буферизуются — тело идёт клиенту как есть.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        elapsed = None
+
+        async def send_with_metrics(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # маршрут появляется в scope после роутинга
+            route = getattr(scope.get("route"), "path", None) or "other"
+            method = scope["method"]
+            REGISTRY.inc("kb_http_requests_total", method=method, route=route, status=status)
+            REGISTRY.observe(
+                "kb_http_request_seconds",
+                elapsed if elapsed is not None else time.perf_counter() - started,
+                method=method, route=route,
+            )
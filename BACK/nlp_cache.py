@@ -0,0 +1,217 @@
+# nlp_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from utils import log
+
+# меняется вместе с правилами извлечения отношений в nlp_model и с ключом
+# кэша, чтобы старые закэшированные результаты не использовались
+# (2 — ключ по точному тексту предложения)
+RESULT_VERSION = 2
+
+DEFAULT_MEMORY_ENTRIES = 50000
+DEFAULT_DISK_ENTRIES = 1000000
+
+
+def nlp_cache_path(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "cache", "nlp.sqlite")
+
+
+class CachedNLPProcessor:
+    """
+    Мемоизация результатов NLPProcessor по предложениям.
+
+    Шаблонные предложения (колонтитулы, дисклеймеры) повторяются в сотнях
+    документов; повторное предложение берётся из кэша без вызова модели.
+    Ключ — хэш точного текста предложения (результат содержит смещения
+    символов, поэтому предложения, отличающиеся хотя бы пробелами, кэшируются
+    отдельно), имя и версия модели и язык (модель выбирается так же, как
+    в NLPProcessor.route).
+    Первый уровень — LRU в памяти, второй (если задан path) — SQLite-файл,
+    который переживает перезапуск. Остальные атрибуты делегируются NLPProcessor.
+    """
+
+    def __init__(self, processor, path=None, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 disk_entries=DEFAULT_DISK_ENTRIES):
+        self.processor = processor
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+
+        self._model_ids = {}
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name == "processor":
+            raise AttributeError(name)
+        return getattr(self.processor, name)
+
+    # -----------------------------
+    # NLP
+    # -----------------------------
+    def process_sentence(self, sent_text):
+        key = self.key(sent_text)
+        result = self._get(key)
+        if result is None:
+            result = self.processor.process_sentence(sent_text)
+            self._put(key, result)
+        return result
+
+    def process_sentences(self, sents, batch_size=None, n_process=None):
+        """
+        То же, что NLPProcessor.process_sentences: генератор (ents, relations)
+        в порядке входа. Вход читается порциями; в модель уходят только
+        предложения, которых нет в кэше.
+        """
+        batch_size = batch_size or self.processor.batch_size
+        n_process = n_process or self.processor.n_process
+        # при n_process > 1 каждый вызов nlp.pipe поднимает процессы заново,
+        # поэтому порция берётся с запасом
+        portion = batch_size if n_process <= 1 else batch_size * n_process * 8
+
+        batch = []
+        for sent in sents:
+            batch.append(sent)
+            if len(batch) >= portion:
+                yield from self._process_batch(batch, batch_size, n_process)
+                batch = []
+        if batch:
+            yield from self._process_batch(batch, batch_size, n_process)
+
+    def _process_batch(self, batch, batch_size, n_process):
+        # повторы внутри порции разбираются один раз: позиции группируются
+        # по ключу, результат раздаётся всем вхождениям
+        positions = OrderedDict()
+        for i, sent in enumerate(batch):
+            positions.setdefault(self.key(sent), []).append(i)
+
+        results = [None] * len(batch)
+        misses = []
+        for key, idx in positions.items():
+            result = self._get(key)
+            if result is None:
+                misses.append(key)
+            else:
+                for i in idx:
+                    results[i] = result
+        if misses:
+            parsed = self.processor.process_sentences(
+                [batch[positions[k][0]] for k in misses],
+                batch_size=batch_size, n_process=n_process
+            )
+            for key, result in zip(misses, parsed):
+                self._put(key, result)
+                for i in positions[key]:
+                    results[i] = result
+        return results
+
+    # -----------------------------
+    # CACHE
+    # -----------------------------
+    def key(self, sent_text):
+        lang = self.processor.route(sent_text)
+        model = self._model_ids.get(lang)
+        if model is None:
+            model = self._model_ids[lang] = f"{self.processor.model_id(lang)}:{RESULT_VERSION}"
+        h = hashlib.sha256()
+        h.update(model.encode())
+        h.update(b"\0")
+        h.update(sent_text.encode("utf-8"))
+        return h.hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return result
+            if self.path:
+                row = self._connect().execute(
+                    "SELECT result FROM nlp WHERE key=?", (key,)
+                ).fetchone()
+                if row is not None:
+                    ents, rels = json.loads(row[0])
+                    result = (ents, rels)
+                    self._remember(key, result)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def _put(self, key, result):
+        ents, rels = result
+        with self._lock:
+            self._remember(key, (ents, rels))
+            if self.path:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO nlp(key, result) VALUES (?, ?)",
+                        (key, json.dumps([ents, rels], ensure_ascii=False))
+                    )
+                self._puts += 1
+                if self._puts % 1000 == 0:
+                    self._trim(conn)
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _trim(self, conn):
+        # на диске вытесняются самые старые записи
+        with conn:
+            conn.execute("""
+                DELETE FROM nlp WHERE rowid <= (
+                    SELECT MAX(rowid) FROM nlp
+                ) - ?
+            """, (self.disk_entries,))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS nlp (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+                "memoryEntries": len(self._memory),
+            }
+
+    def log_stats(self):
+        s = self.stats()
+        log(f"NLP-кэш: hit rate {s['hitRate']:.1%} ({s['hits']} из {s['hits'] + s['misses']})")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
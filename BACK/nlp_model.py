@@ -1,21 +1,140 @@
 # nlp_model.py
-import spacy
+import re
+import threading
+import metrics
 from utils import log
 
+MODELS = {
+    "ru": "ru_core_news_lg",
+    "en": "en_core_web_trf",
+}
+
+# компоненты, результат которых используется: сущности (ner), разбор
+# зависимостей (parser), части речи и леммы для отношений; остальные
+# (senter, textcat, ...) не загружаются
+USED_COMPONENTS = {
+    "tok2vec", "transformer", "morphologizer", "tagger",
+    "attribute_ruler", "parser", "lemmatizer", "ner",
+}
+
+CYRILLIC = re.compile(r"[а-яё]", re.I)
+LATIN = re.compile(r"[a-z]", re.I)
+
+# при такой или большей доле одного алфавита язык определяется без langdetect
+SCRIPT_CONFIDENCE = 0.8
+
+
+def detect_language(text, default="ru"):
+    """
+    'ru' или 'en' для предложения. Для ru/en достаточно посчитать буквы
+    кириллицы и латиницы; langdetect вызывается только для смешанного текста.
+    """
+    cyr = len(CYRILLIC.findall(text))
+    lat = len(LATIN.findall(text))
+    if cyr + lat == 0:
+        return default
+    share = cyr / (cyr + lat)
+    if share >= SCRIPT_CONFIDENCE:
+        return "ru"
+    if share <= 1 - SCRIPT_CONFIDENCE:
+        return "en"
+    try:
+        from langdetect import detect
+        lang = detect(text)
+    except Exception:
+        return "ru" if share >= 0.5 else "en"
+    return lang if lang in MODELS else ("ru" if share >= 0.5 else "en")
+
+
 class NLPProcessor:
-    def __init__(self, lang_preference='ru'):
+    def __init__(self, lang_preference='ru', batch_size=64, n_process=1):
+        """
+        lang_preference — 'ru', 'en' или 'auto' (язык определяется для каждого
+        предложения, модели загружаются по мере появления языков).
+        Модели загружаются при первом использовании и кэшируются по языку.
+        """
         self.lang = lang_preference
-        if self.lang == 'ru':
-            try:
-                self.nlp = spacy.load("ru_core_news_lg")
-            except Exception as e:
-                log("Не найден ru_core_news_lg: попробуйте 'python -m spacy download ru_core_news_lg'")
-                raise
-        else:
-            self.nlp = spacy.load("en_core_web_trf")
+        self.default_lang = "ru" if lang_preference == "auto" else lang_preference
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nlp(self):
+        return self.model(self.default_lang)
+
+    def model(self, lang):
+        nlp = self._models.get(lang)
+        if nlp is None:
+            with self._lock:
+                nlp = self._models.get(lang)
+                if nlp is None:
+                    with metrics.timer("kb_nlp_model_load_seconds", lang=lang):
+                        nlp = self._models[lang] = _load_model(lang)
+        return nlp
+
+    def preload(self):
+        """Загружает модель языка по умолчанию заранее (прогрев воркера)."""
+        self.model(self.default_lang)
+
+    def model_id(self, lang):
+        """Имя и версия пакета модели — без загрузки самой модели."""
+        name = MODELS[lang]
+        try:
+            from spacy.util import get_package_version
+            version = get_package_version(name)
+        except Exception:
+            version = None
+        return f"{name}:{version or ''}:{lang}"
+
+    def route(self, text):
+        if self.lang == "auto":
+            return detect_language(text, self.default_lang)
+        return self.lang
 
     def process_sentence(self, sent_text):
-        doc = self.nlp(sent_text)
+        return self._doc_result(self.model(self.route(sent_text))(sent_text))
+
+    def process_sentences(self, sents, batch_size=None, n_process=None):
+        """
+        Пакетная обработка через nlp.pipe. Возвращает генератор пар
+        (ents, relations) в том же порядке, что и входные предложения.
+        """
+        batch_size = batch_size or self.batch_size
+        n_process = n_process or self.n_process
+        if self.lang != "auto":
+            docs = self.model(self.lang).pipe(sents, batch_size=batch_size, n_process=n_process)
+            for doc in docs:
+                yield self._doc_result(doc)
+            return
+
+        # auto: порция предложений делится по языкам, каждая часть идёт
+        # в свою модель, результаты возвращаются в исходном порядке
+        portion = []
+        for sent in sents:
+            portion.append(sent)
+            if len(portion) >= batch_size:
+                yield from self._process_routed(portion, batch_size, n_process)
+                portion = []
+        if portion:
+            yield from self._process_routed(portion, batch_size, n_process)
+
+    def _process_routed(self, sents, batch_size, n_process):
+        by_lang = {}
+        for i, sent in enumerate(sents):
+            by_lang.setdefault(self.route(sent), []).append(i)
+        results = [None] * len(sents)
+        for lang, idx in by_lang.items():
+            docs = self.model(lang).pipe(
+                [sents[i] for i in idx], batch_size=batch_size, n_process=n_process
+            )
+            for i, doc in zip(idx, docs):
+                results[i] = self._doc_result(doc)
+        return results
+
+    def _doc_result(self, doc):
+        metrics.inc("kb_nlp_sentences_total", lang=doc.lang_)
         ents = []
         for ent in doc.ents:
             ents.append({
@@ -32,7 +151,8 @@ class NLPProcessor:
         """
         Простая правило-ориентированная извлечь отношений:
          - ищем глагол (ROOT или VERB) с субъектом (nsubj) и объектом (obj/obl)
-         - возвращаем triples (subj_text, verb_lemma, obj_text)
+         - возвращаем triples (subj_text, verb_lemma, obj_text) со смещениями
+           субъекта и объекта в предложении (для связи с сущностями)
         """
         rels = []
         for token in doc:
@@ -50,7 +170,11 @@ class NLPProcessor:
                     rels.append({
                         'subj': subj_span.text,
                         'pred': token.lemma_,
-                        'obj': obj_span.text
+                        'obj': obj_span.text,
+                        'subj_start': subj_span.start_char,
+                        'subj_end': subj_span.end_char,
+                        'obj_start': obj_span.start_char,
+                        'obj_end': obj_span.end_char
                     })
         return rels
 
@@ -59,3 +183,31 @@ class NLPProcessor:
         left = token.left_edge.i
         right = token.right_edge.i
         return token.doc[left:right+1]
+
+
+def _load_model(lang):
+    import spacy
+
+    name = MODELS.get(lang)
+    if name is None:
+        raise ValueError(f"Нет модели для языка {lang}")
+    log(f"Загрузка модели {name}...")
+    try:
+        nlp = spacy.load(name, exclude=_unused_components(name))
+    except Exception:
+        if lang == "ru":
+            log("Не найден ru_core_news_lg: попробуйте 'python -m spacy download ru_core_news_lg'")
+        raise
+    log(f"Модель {name} загружена: {', '.join(nlp.pipe_names)}")
+    return nlp
+
+
+def _unused_components(name):
+    # состав пайплайна берётся из meta.json пакета, до загрузки весов
+    try:
+        from spacy.util import get_package_path, load_meta
+        meta = load_meta(get_package_path(name) / "meta.json")
+    except Exception:
+        return []
+    components = meta.get("components") or meta.get("pipeline") or []
+    return [c for c in components if c not in USED_COMPONENTS]
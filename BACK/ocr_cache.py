@@ -0,0 +1,127 @@
+# ocr_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def ocr_cache_path(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "cache", "ocr.sqlite")
+
+
+def image_key(image, ocr_lang, resolution):
+    """Ключ кэша: хэш растра страницы + язык OCR + разрешение растеризации."""
+    h = hashlib.sha256()
+    h.update(f"{ocr_lang}:{resolution}:{image.mode}:{image.size[0]}x{image.size[1]};".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class OcrCache:
+    """
+    Дисковый кэш результатов OCR (отдельный SQLite-файл рядом с БД).
+
+    Ключ — хэш отрендеренной страницы, язык и разрешение, поэтому повторная
+    обработка неизменённых сканов не запускает Tesseract. Объём ограничен
+    max_bytes: при переполнении вытесняются давно не использованные записи.
+    Счётчики попаданий и промахов хранятся в том же файле и общие для всех
+    процессов, которые пишут в кэш.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # соединение не переносится в дочерние процессы — открываем заново
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS ocr (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_ocr_last_used ON ocr(last_used);
+                CREATE TABLE IF NOT EXISTS ocr_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0,
+                    evictions INTEGER NOT NULL DEFAULT 0,
+                    bytes INTEGER NOT NULL DEFAULT 0
+                );
+                INSERT OR IGNORE INTO ocr_stats(id) VALUES (1);
+            """)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT text FROM ocr WHERE key=?", (key,)).fetchone()
+                if row is None:
+                    conn.execute("UPDATE ocr_stats SET misses = misses + 1 WHERE id = 1")
+                    return None
+                conn.execute("UPDATE ocr SET last_used=? WHERE key=?", (time.time(), key))
+                conn.execute("UPDATE ocr_stats SET hits = hits + 1 WHERE id = 1")
+                return row[0]
+
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                old = conn.execute("SELECT size FROM ocr WHERE key=?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO ocr(key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, text, size, time.time())
+                )
+                conn.execute(
+                    "UPDATE ocr_stats SET bytes = bytes + ? WHERE id = 1",
+                    (size - (old[0] if old else 0),)
+                )
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT bytes FROM ocr_stats WHERE id = 1").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM ocr ORDER BY last_used"):
+            evicted.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM ocr WHERE key=?", evicted)
+        conn.execute(
+            "UPDATE ocr_stats SET bytes = bytes - ?, evictions = evictions + ? WHERE id = 1",
+            (freed, len(evicted))
+        )
+
+    def stats(self):
+        with self._lock:
+            hits, misses, evictions, size = self._connect().execute(
+                "SELECT hits, misses, evictions, bytes FROM ocr_stats WHERE id = 1"
+            ).fetchone()
+        return {"hits": hits, "misses": misses, "evictions": evictions, "bytes": size}
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
@@ -1,96 +1,261 @@
 # pipeline.py
 import argparse
 import os
+import queue
+import threading
+import time
+from collections import deque
+import metrics
 from ingest import DocumentIngestor
 from nlp_model import NLPProcessor
 from storage import Storage
 from preprocess import TextPreprocessor
+from manifest import FileManifest
+from ocr_cache import ocr_cache_path
+from nlp_cache import CachedNLPProcessor, nlp_cache_path
 from utils import setup_logging, log
 
 
+# частей текста (страниц, абзацев), прочитанных наперёд
+PREFETCH_CHUNKS = 8
+
+
+def process_document(doc_id, text, preproc, nlp, storage, progress=None, timings=None):
+    """
+    Извлекает предложения, сущности и отношения из текста документа
+    и сохраняет их в БД под уже созданной записью doc_id.
+    Используется и CLI-пайплайном, и резидентными воркерами (worker.py).
+
+    text — строка или итерируемое частей текста (DocumentIngestor.iter_file).
+    Этапы связаны генераторами: части текста -> предложения -> пакеты NLP ->
+    пакеты записи в БД, поэтому память не зависит от размера документа,
+    а первые предложения сохраняются, пока дальние страницы ещё читаются.
+    Чтение идёт в отдельном потоке через ограниченную очередь.
+    progress(sentences_done=..., sentences_total=...) вызывается после
+    каждого пакета NLP; sentences_total известен только в конце.
+
+    timings (metrics.StageTimings) — время стадий read, wait (ожидание
+    чтения), segment, nlp и write; сохраняется в documents.timings.
+    Передаётся, если его заполняет и DocumentIngestor.iter_file.
+    """
+    if timings is None:
+        timings = metrics.stage_timings()
+    source = None
+    if isinstance(text, str):
+        chunks = [text]
+    else:
+        source = _prefetch(timings.iter("read", text), PREFETCH_CHUNKS)
+        chunks = timings.iter("wait", source)
+
+    started = time.perf_counter()
+    try:
+        # Разбиваем текст на предложения по мере чтения
+        sents = timings.iter("segment", preproc.iter_sentences(chunks))
+
+        # Пропускаем через NLP-модель пакетами (nlp.pipe), порядок сохраняется;
+        # запись — пакетами, статус "completed" — в завершающей транзакции
+        results = timings.iter("nlp", _with_sentences(sents, nlp))
+        if progress:
+            results = _with_progress(results, nlp.batch_size, progress)
+        with timings.stage("write"):
+            sentence_count, entity_count = storage.write_document(doc_id, results)
+    finally:
+        if source is not None:
+            source.close()
+
+    stages = timings.as_dict()
+    if stages is not None:
+        storage.set_document_timings(doc_id, stages)
+    metrics.record_document(stages)
+
+    if progress:
+        progress(sentences_done=sentence_count, sentences_total=sentence_count)
+
+    elapsed = time.perf_counter() - started
+    rate = sentence_count / elapsed if elapsed > 0 else 0.0
+    detail = ""
+    if stages:
+        detail = " (" + ", ".join(f"{k} {v:.2f}s" for k, v in stages["stages"].items()) + ")"
+    log(
+        f"Документ обработан: id={doc_id}, sentences={sentence_count}, entities={entity_count}, "
+        f"{rate:.1f} sent/s{detail}"
+    )
+    if isinstance(nlp, CachedNLPProcessor):
+        nlp.log_stats()
+    return sentence_count, entity_count
+
+
+def _with_sentences(sents, nlp):
+    """(sentence, ents, relations): nlp.pipe читает вход пакетами, текст ждёт в очереди."""
+    pending = deque()
+
+    def feed():
+        for sent in sents:
+            pending.append(sent)
+            yield sent
+
+    for ents, relations in nlp.process_sentences(feed()):
+        yield pending.popleft(), ents, relations
+
+
+def _with_progress(results, every, progress):
+    progress(sentences_done=0, sentences_total=None)
+    done = 0
+    for item in results:
+        yield item
+        done += 1
+        if done % every == 0:
+            progress(sentences_done=done)
+
+
+def _prefetch(items, maxsize):
+    """
+    Итерирует items в отдельном потоке через очередь на maxsize элементов:
+    чтение и OCR следующих страниц идут параллельно с NLP. Исключение
+    источника пробрасывается потребителю; при закрытии генератора
+    поток останавливается.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(items)
+        try:
+            for item in it:
+                if not put((item, None)):
+                    break
+            else:
+                put((done, None))
+        except Exception as e:
+            put((done, e))
+        finally:
+            close = getattr(it, "close", None)
+            if close:
+                close()
+
+    t = threading.Thread(target=produce, name="prefetch", daemon=True)
+    t.start()
+    try:
+        while True:
+            item, error = q.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stop.set()
+        t.join()
+
+
 def main(args):
     setup_logging()
     log("Запуск пайплайна извлечения знаний")
 
-    ingestor = DocumentIngestor()
+    ingestor = DocumentIngestor(
+        workers=args.ocr_workers,
+        page_timeout=args.page_timeout,
+        cache_path=ocr_cache_path(args.output) if args.ocr_cache_mb else None,
+        cache_max_bytes=args.ocr_cache_mb * 1024 * 1024,
+    )
     preproc = TextPreprocessor()
-    nlp = NLPProcessor(lang_preference=args.lang)
+    nlp = NLPProcessor(
+        lang_preference=args.lang,
+        batch_size=args.batch_size,
+        n_process=args.n_process,
+    )
+    if args.nlp_cache_entries:
+        nlp = CachedNLPProcessor(
+            nlp,
+            path=None if args.no_nlp_cache_db else nlp_cache_path(args.output),
+            memory_entries=args.nlp_cache_entries,
+        )
     storage = Storage(db_path=args.output)
 
     # Инициализируем/создаем БД
     storage.init_db()
+    partial = storage.recover_partial_writes()
+    if partial:
+        log(f"Удалены данные прерванной записи документов: {partial}")
 
-    # Загружаем документы
-    docs = ingestor.ingest_folder(args.input)
-    log(f"Найдено документов: {len(docs)}")
+    # Загружаем только новые и изменённые документы
+    manifest = None if args.full else FileManifest(storage)
+    # (текст читается потоково при обработке каждого документа)
+    docs = list(ingestor.scan_folder(args.input, manifest=manifest))
+    log(f"Найдено документов к обработке: {len(docs)}")
 
     for doc_meta in docs:
         filename = os.path.basename(doc_meta["path"])
 
         # 1. Добавляем запись о документе (status = 'processing')
-        doc_id = storage.add_document(filename)
-        log(f"Документ добавлен в БД: id={doc_id}, name={filename}")
+        doc_id = doc_meta["document_id"]
+        if doc_id is None:
+            doc_id = storage.add_document(filename)
+            log(f"Документ добавлен в БД: id={doc_id}, name={filename}")
+        else:
+            storage.update_document_status(doc_id, "processing")
+            log(f"Документ изменён, переобработка: id={doc_id}, name={filename}")
 
-        # 2. Разбиваем текст на предложения
-        sents = preproc.sent_tokenize_and_clean(doc_meta["text"])
+        try:
+            timings = metrics.stage_timings()
+            chunks = ingestor.iter_file(doc_meta["path"], timings=timings)
+            process_document(doc_id, chunks, preproc, nlp, storage, timings=timings)
+        except Exception as e:
+            log(f"Ошибка при обработке {doc_meta['path']}: {e}")
+            metrics.inc("kb_documents_total", status="error")
+            storage.update_document_status(doc_id, "error")
+            continue
 
-        sentence_count = 0
-        entity_count = 0
-
-        for sent in sents:
-            # Добавляем предложение
-            sentence_id = storage.add_sentence(doc_id, sent)
-            sentence_count += 1
-
-            # Пропускаем через NLP-модель
-            ents, relations = nlp.process_sentence(sent)
-
-            # Добавляем сущности
-            for e in ents:
-                storage.add_entity(
-                    doc_id,
-                    sentence_id,
-                    e["text"],
-                    e["label"],
-                    e.get("start_char"),
-                    e.get("end_char")
-                )
-                entity_count += 1
-
-            # Добавляем отношения
-            for r in relations:
-                storage.add_relation(
-                    doc_id,
-                    sentence_id,
-                    r["subj"],
-                    r["pred"],
-                    r["obj"]
-                )
-
-        # 3. Обновляем статистику документа
-        storage.update_counts(doc_id, entity_count, sentence_count)
-
-        # 4. Переводим документ в состояние "completed"
-        storage.update_document_status(doc_id, "completed")
-
-        log(
-            f"Документ обработан: id={doc_id}, sentences={sentence_count}, entities={entity_count}"
-        )
+        if doc_meta["file"] is not None:
+            manifest.record(doc_meta["file"], doc_id=doc_id)
 
-    # экспорт
-    storage.export_graphml(args.graphml)
-    storage.export_jsonld(args.jsonld)
+    # экспорт по запросу (API отдаёт GraphML и JSON-LD потоково через /export/*)
+    if args.graphml:
+        storage.export_graphml(args.graphml)
+    if args.jsonld:
+        storage.export_jsonld(args.jsonld)
 
-    log("Готово. Графы экспортированы.")
+    ingestor.close()
+    if isinstance(nlp, CachedNLPProcessor):
+        nlp.log_stats()
+        nlp.close()
+    log("Готово.")
 
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser(description="Pipeline for Document Knowledge Extraction")
     p.add_argument("--input", required=True, help="Папка с документами")
     p.add_argument("--output", default="out.sqlite", help="SQLite файл вывода")
-    p.add_argument("--graphml", default="graph.out.graphml", help="GraphML export path")
-    p.add_argument("--jsonld", default="graph.out.jsonld", help="JSON-LD export path")
-    p.add_argument("--lang", default="ru", choices=["ru", "en"], help="Язык для NER")
+    p.add_argument("--graphml", default=None, help="GraphML export path (по умолчанию не экспортируется)")
+    p.add_argument("--jsonld", default=None, help="JSON-LD export path (по умолчанию не экспортируется)")
+    p.add_argument("--lang", default="ru", choices=["ru", "en", "auto"],
+                   help="Язык для NER; auto — определять для каждого предложения")
+    p.add_argument("--batch-size", type=int, default=64,
+                   help="Размер пакета предложений для nlp.pipe")
+    p.add_argument("--n-process", type=int, default=1,
+                   help="Число процессов spaCy для nlp.pipe")
+    p.add_argument("--ocr-workers", type=int, default=None,
+                   help="Процессов для постраничного чтения PDF и OCR (по умолчанию — число ядер)")
+    p.add_argument("--page-timeout", type=int, default=120,
+                   help="Лимит OCR на страницу, секунд")
+    p.add_argument("--ocr-cache-mb", type=int, default=256,
+                   help="Размер кэша результатов OCR, МБ (0 — без кэша)")
+    p.add_argument("--nlp-cache-entries", type=int, default=50000,
+                   help="Размер кэша результатов NLP по предложениям (0 — без кэша)")
+    p.add_argument("--no-nlp-cache-db", action="store_true",
+                   help="Не сохранять кэш NLP на диск")
+    p.add_argument("--full", action="store_true",
+                   help="Обработать все файлы, игнорируя манифест")
 
     args = p.parse_args()
     main(args)
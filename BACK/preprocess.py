@@ -1,23 +1,143 @@
 # preprocess.py
 import re
+from bisect import bisect_right
+
+# номер страницы вида "Page 3" (колонтитул) — выбрасывается из текста
+PAGE_NUMBER = r'(?i:\bPage\s*\d+\b)'
+PAGE_REGEX = re.compile(PAGE_NUMBER)
+
+# предложение — от непробельного символа до [.?!…], за которыми идёт пробел,
+# номер страницы или конец текста; без такой границы — до конца текста
+# (group "tail": предложение, возможно, продолжается в следующей части)
+SENTENCE_REGEX = re.compile(
+    rf'(?=\S)[^.?!…]*(?:[.?!…]+(?!\s|{PAGE_NUMBER}|\Z)[^.?!…]*)*(?:[.?!…]+|(?P<tail>\Z))'
+)
+
+# граница предложения в тексте, дописанном к незаконченному предложению,
+# возможна, только если в новой части есть [.?!…] или хвост кончается
+# на "[.?!…]Page" (номер страницы — в новой части)
+TERMINATOR_REGEX = re.compile(r'[.?!…]')
+TAIL_PAGE_REGEX = re.compile(r'[.?!…]+(?i:Page)\s*\Z')
+
+# слова очищенного предложения: номера страниц отделяются от соседних слов
+TOKEN_REGEX = re.compile(rf'(?P<page>{PAGE_NUMBER})|\S+?(?={PAGE_NUMBER}|\s|\Z)')
+
+# хвост без границы предложения длиннее этого выдаётся принудительно,
+# чтобы текст без пунктуации не копился в памяти целиком
+MAX_SENTENCE_CHARS = 10000
+
+
+class Sentence(str):
+    """
+    Очищенное предложение (обычная строка) с позицией в исходном тексте.
+
+    start/end — смещения в тексте документа (части, склеенные через "\\n",
+    как в DocumentIngestor.read_file); to_source переводит смещение внутри
+    предложения (например, start_char сущности) в смещение в документе.
+    """
+
+    def __new__(cls, text, source, start):
+        s = super().__new__(cls, text)
+        s.source = source
+        s.start = start
+        s.end = start + len(source)
+        s._offsets = None
+        return s
+
+    def to_source(self, pos):
+        if self._offsets is None:
+            # слова предложения разделены одним пробелом,
+            # внутри слова смещения совпадают с исходными
+            offsets = []
+            source_offsets = []
+            n = 0
+            for m in TOKEN_REGEX.finditer(self.source):
+                if m.lastgroup is None:
+                    offsets.append(n)
+                    source_offsets.append(m.start())
+                    n += len(m.group()) + 1
+            self._offsets = (offsets, source_offsets)
+        offsets, source_offsets = self._offsets
+        if not offsets:
+            return self.start
+        i = max(bisect_right(offsets, pos) - 1, 0)
+        return self.start + source_offsets[i] + (pos - offsets[i])
+
+    def __reduce__(self):
+        return (Sentence, (str(self), self.source, self.start))
+
+
+def clean_sentence(source):
+    """Схлопывает пробелы и убирает номера страниц в одном предложении."""
+    return " ".join(PAGE_REGEX.sub(" ", source).split())
 
-SENT_BOUNDARY_REGEX = re.compile(r'(?<=[\.\?\!…])\s+')
 
 class TextPreprocessor:
     def __init__(self):
         pass
 
     def clean_text(self, text):
-        # удалить многократные пробелы, номера страниц и колонтитулы простым способом
-        t = re.sub(r'\s+', ' ', text)
-        t = re.sub(r'\n{2,}', '\n', t)
-        # убрать номера страниц вида "1 / 10" или просто строки с числами (осторожно)
-        t = re.sub(r'\bPage\s*\d+\b', '', t, flags=re.I)
-        return t.strip()
+        # удалить многократные пробелы и номера страниц (колонтитулы)
+        return clean_sentence(text)
 
     def sent_tokenize_and_clean(self, text):
-        text = self.clean_text(text)
-        # простая сегментация предложений
-        parts = SENT_BOUNDARY_REGEX.split(text)
-        sents = [p.strip() for p in parts if len(p.strip()) > 5]
-        return sents
+        return list(self.iter_sentences([text]))
+
+    def iter_sentences(self, chunks):
+        """
+        Потоковая очистка и сегментация за один проход по тексту: chunks —
+        части текста по порядку (страницы, абзацы). Выдаёт Sentence по мере
+        чтения; незаконченное предложение в конце части переносится
+        в следующую. Очищается каждое предложение отдельно, копия всего
+        текста не строится.
+        """
+        # незаконченное предложение — списком частей: часть без границы
+        # предложения дописывается к нему без повторного разбора хвоста
+        parts = []
+        tail_len = 0
+        tail_start = 0
+        tail_page = False
+        base = 0
+        for chunk in chunks:
+            if parts and not tail_page and not TERMINATOR_REGEX.search(chunk):
+                parts.append(chunk)
+                tail_len += len(chunk) + 1
+            else:
+                if parts:
+                    parts.append(chunk)
+                    text = "\n".join(parts)
+                    offset = tail_start
+                else:
+                    text = chunk
+                    offset = base
+                parts = []
+                tail_len = 0
+                for m in SENTENCE_REGEX.finditer(text):
+                    if m.group("tail") is not None:
+                        parts = [m.group()]
+                        tail_len = len(m.group())
+                        tail_start = offset + m.start()
+                        tail_page = TAIL_PAGE_REGEX.search(m.group()) is not None
+                        break
+                    sent = _sentence(m.group(), offset + m.start())
+                    if sent is not None:
+                        yield sent
+            if tail_len > MAX_SENTENCE_CHARS:
+                sent = _sentence("\n".join(parts), tail_start)
+                if sent is not None:
+                    yield sent
+                parts = []
+                tail_len = 0
+            base += len(chunk) + 1
+        if parts:
+            sent = _sentence("\n".join(parts), tail_start)
+            if sent is not None:
+                yield sent
+
+
+def _sentence(source, start):
+    # простая сегментация предложений: короткие обрывки отбрасываются
+    text = clean_sentence(source)
+    if len(text) <= 5:
+        return None
+    return Sentence(text, source, start)
@@ -1,73 +1,822 @@
 # storage.py
+import json
 import sqlite3
 import os
+import re
 from datetime import datetime
+import metrics
 from utils import log
-import networkx as nx
-import json
+from export import iter_graphml, JsonLdCache, jsonld_cache_dir
+from graph_cache import GraphCache, graph_cache_dir
 
+# WAL: читатели не блокируют запись; synchronous=NORMAL в WAL безопасен
+# для целостности и не делает fsync на каждый коммит
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
 
-class Storage:
-    def __init__(self, db_path="out.sqlite"):
-        self.db_path = db_path
-        self.conn = None
+# предложений в одной транзакции записи документа
+WRITE_BATCH_SIZE = 500
 
-    def init_db(self):
-        self.conn = sqlite3.connect(self.db_path)
-        c = self.conn.cursor()
 
-        # Документы
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT,
-            uploaded_at TEXT,
-            status TEXT,
-            entities_count INTEGER DEFAULT 0,
-            sentences_count INTEGER DEFAULT 0
-        )
+# -----------------------------
+# MIGRATIONS
+# -----------------------------
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция переводит
+# БД с версии N-1 на N и выполняется в своей транзакции; существующие
+# файлы out.sqlite обновляются на месте при init_db.
+
+def _migration_base(c):
+    # Документы
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT,
+        uploaded_at TEXT,
+        status TEXT,
+        entities_count INTEGER DEFAULT 0,
+        sentences_count INTEGER DEFAULT 0
+    )
+    """)
+
+    # Предложения
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sentences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        text TEXT,
+        FOREIGN KEY (document_id) REFERENCES documents(id)
+    )
+    """)
+
+    # Сущности
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS entities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        sentence_id INTEGER,
+        text TEXT,
+        label TEXT,
+        start_char INTEGER,
+        end_char INTEGER,
+        FOREIGN KEY (document_id) REFERENCES documents(id),
+        FOREIGN KEY (sentence_id) REFERENCES sentences(id)
+    )
+    """)
+
+    # Отношения
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS relations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        sentence_id INTEGER,
+        subj TEXT,
+        pred TEXT,
+        obj TEXT,
+        FOREIGN KEY (document_id) REFERENCES documents(id),
+        FOREIGN KEY (sentence_id) REFERENCES sentences(id)
+    )
+    """)
+
+    # Манифест входных файлов: путь -> размер, mtime, хэш содержимого, документ
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        sha256 TEXT,
+        document_id INTEGER,
+        FOREIGN KEY (document_id) REFERENCES documents(id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256)")
+
+
+def _migration_cascade_indexes(c):
+    """
+    Пересобирает дочерние таблицы с ON DELETE CASCADE (SQLite не умеет
+    менять внешние ключи через ALTER TABLE) и добавляет индексы
+    для выборок по документу, предложению и тексту сущности.
+    """
+    c.execute("""
+    CREATE TABLE sentences_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        text TEXT,
+        FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+    )
+    """)
+    c.execute("""
+    CREATE TABLE entities_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        sentence_id INTEGER,
+        text TEXT,
+        label TEXT,
+        start_char INTEGER,
+        end_char INTEGER,
+        FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE,
+        FOREIGN KEY (sentence_id) REFERENCES sentences(id) ON DELETE CASCADE
+    )
+    """)
+    c.execute("""
+    CREATE TABLE relations_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        sentence_id INTEGER,
+        subj TEXT,
+        pred TEXT,
+        obj TEXT,
+        FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE,
+        FOREIGN KEY (sentence_id) REFERENCES sentences(id) ON DELETE CASCADE
+    )
+    """)
+    c.execute("""
+    CREATE TABLE files_new (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        sha256 TEXT,
+        document_id INTEGER,
+        FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+    )
+    """)
+
+    # строки удалённых документов (осиротевшие) не переносятся
+    c.execute("""
+        INSERT INTO sentences_new(id, document_id, text)
+        SELECT id, document_id, text FROM sentences
+        WHERE document_id IN (SELECT id FROM documents)
+    """)
+    c.execute("""
+        INSERT INTO entities_new(id, document_id, sentence_id, text, label, start_char, end_char)
+        SELECT id, document_id, sentence_id, text, label, start_char, end_char FROM entities
+        WHERE document_id IN (SELECT id FROM documents)
+    """)
+    c.execute("""
+        INSERT INTO relations_new(id, document_id, sentence_id, subj, pred, obj)
+        SELECT id, document_id, sentence_id, subj, pred, obj FROM relations
+        WHERE document_id IN (SELECT id FROM documents)
+    """)
+    c.execute("""
+        INSERT INTO files_new(path, size, mtime_ns, sha256, document_id)
+        SELECT path, size, mtime_ns, sha256, document_id FROM files
+        WHERE document_id IN (SELECT id FROM documents)
+    """)
+
+    # счётчики AUTOINCREMENT сохраняются, чтобы id удалённых строк не переиспользовались
+    sequences = dict(c.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+
+    for table in ("sentences", "entities", "relations", "files"):
+        c.execute(f"DROP TABLE {table}")
+        c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    for table in ("sentences", "entities", "relations"):
+        if table in sequences:
+            c.execute("DELETE FROM sqlite_sequence WHERE name=?", (table,))
+            c.execute(f"""
+                INSERT INTO sqlite_sequence(name, seq)
+                SELECT ?, MAX(?, COALESCE(MAX(id), 0)) FROM {table}
+            """, (table, sequences[table]))
+
+    c.execute("CREATE INDEX idx_sentences_document ON sentences(document_id)")
+    c.execute("CREATE INDEX idx_entities_document ON entities(document_id, sentence_id)")
+    c.execute("CREATE INDEX idx_entities_sentence ON entities(sentence_id)")
+    c.execute("CREATE INDEX idx_entities_doc_text ON entities(document_id, text COLLATE NOCASE)")
+    c.execute("CREATE INDEX idx_entities_text ON entities(text COLLATE NOCASE)")
+    c.execute("CREATE INDEX idx_relations_document ON relations(document_id, sentence_id)")
+    c.execute("CREATE INDEX idx_relations_sentence ON relations(sentence_id)")
+    c.execute("CREATE INDEX idx_files_sha256 ON files(sha256)")
+    c.execute("CREATE INDEX idx_files_document ON files(document_id)")
+
+
+def _migration_relation_entities(c):
+    """
+    Добавляет в relations ссылки на сущности субъекта и объекта и заполняет
+    их для существующих данных по тексту (сначала в том же предложении).
+    """
+    c.execute("""
+        ALTER TABLE relations ADD COLUMN subj_entity_id INTEGER
+        REFERENCES entities(id) ON DELETE SET NULL
+    """)
+    c.execute("""
+        ALTER TABLE relations ADD COLUMN obj_entity_id INTEGER
+        REFERENCES entities(id) ON DELETE SET NULL
+    """)
+    for column, text_column in (("subj_entity_id", "subj"), ("obj_entity_id", "obj")):
+        c.execute(f"""
+            UPDATE relations SET {column} = (
+                SELECT MIN(e.id) FROM entities e
+                WHERE e.sentence_id = relations.sentence_id
+                  AND e.text = relations.{text_column} COLLATE NOCASE
+            )
         """)
+        c.execute(f"""
+            UPDATE relations SET {column} = (
+                SELECT MIN(e.id) FROM entities e
+                WHERE e.document_id = relations.document_id
+                  AND e.text = relations.{text_column} COLLATE NOCASE
+            )
+            WHERE {column} IS NULL
+        """)
+    c.execute("CREATE INDEX idx_relations_subj_entity ON relations(subj_entity_id)")
+    c.execute("CREATE INDEX idx_relations_obj_entity ON relations(obj_entity_id)")
 
-        # Предложения
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS sentences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id INTEGER,
-            text TEXT,
-            FOREIGN KEY (document_id) REFERENCES documents(id)
-        )
+
+def _migration_fts(c):
+    """
+    Полнотекстовые индексы FTS5 по тексту сущностей и предложений
+    (external content: текст хранится только в основных таблицах).
+    Индексы поддерживаются триггерами, в том числе при каскадном удалении.
+    """
+    for table in ("entities", "sentences"):
+        c.execute(f"""
+            CREATE VIRTUAL TABLE {table}_fts USING fts5(
+                text,
+                content='{table}',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        c.execute(f"""
+            CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts(rowid, text) VALUES (new.id, new.text);
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts({table}_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END
         """)
+        c.execute(f"""
+            CREATE TRIGGER {table}_fts_au AFTER UPDATE OF text ON {table} BEGIN
+                INSERT INTO {table}_fts({table}_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO {table}_fts(rowid, text) VALUES (new.id, new.text);
+            END
+        """)
+        c.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
 
-        # Сущности
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS entities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id INTEGER,
-            sentence_id INTEGER,
-            text TEXT,
-            label TEXT,
-            start_char INTEGER,
-            end_char INTEGER,
-            FOREIGN KEY (document_id) REFERENCES documents(id),
-            FOREIGN KEY (sentence_id) REFERENCES sentences(id)
-        )
+
+def _migration_jobs(c):
+    """Персистентная очередь заданий извлечения (jobs.JobQueue)."""
+    c.execute("""
+    CREATE TABLE jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT,
+        priority INTEGER DEFAULT 0,
+        status TEXT,
+        document_id INTEGER,
+        path TEXT,
+        filename TEXT,
+        file_info TEXT,
+        duplicate INTEGER DEFAULT 0,
+        pages_done INTEGER DEFAULT 0,
+        pages_total INTEGER,
+        sentences_done INTEGER DEFAULT 0,
+        sentences_total INTEGER,
+        error TEXT,
+        version INTEGER DEFAULT 0,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+    )
+    """)
+    c.execute("CREATE INDEX idx_jobs_queue ON jobs(status, priority DESC, created_at)")
+    c.execute("CREATE INDEX idx_jobs_document ON jobs(document_id)")
+
+
+def _migration_document_offsets(c):
+    """
+    Смещения предложений и сущностей в тексте документа (preprocess.Sentence):
+    start_char/end_char сущностей отсчитываются от начала предложения.
+    """
+    c.execute("ALTER TABLE sentences ADD COLUMN doc_start INTEGER")
+    c.execute("ALTER TABLE sentences ADD COLUMN doc_end INTEGER")
+    c.execute("ALTER TABLE entities ADD COLUMN doc_start INTEGER")
+    c.execute("ALTER TABLE entities ADD COLUMN doc_end INTEGER")
+
+
+def _migration_document_timings(c):
+    """Время стадий последней обработки документа (metrics.StageTimings), JSON."""
+    c.execute("ALTER TABLE documents ADD COLUMN timings TEXT")
+
+
+# счётчики корпуса: (имя, таблица, столбец разбивки или None)
+COUNTERS = (
+    ("documents", "documents", None),
+    ("documents_status", "documents", "status"),
+    ("sentences", "sentences", None),
+    ("entities", "entities", None),
+    ("entity_label", "entities", "label"),
+    ("relations", "relations", None),
+    ("relation_pred", "relations", "pred"),
+)
+
+
+def _counter_key(column, row):
+    return "''" if column is None else f"COALESCE({row}.{column}, '')"
+
+
+def _counter_upsert(name, key, delta):
+    """SQL для триггера: counters[name, key] += delta; key — SQL-выражение."""
+    return f"""
+        INSERT INTO counters(name, key, value) VALUES ('{name}', {key}, {delta})
+        ON CONFLICT(name, key) DO UPDATE SET value = value + excluded.value;"""
+
+
+def _migration_counters(c):
+    """
+    Счётчики корпуса для /stats (таблица counters): число строк documents,
+    sentences, entities, relations и разбивки — документы по статусу,
+    сущности по метке, отношения по предикату. Поддерживаются триггерами
+    в той же транзакции, что и изменение строк, в том числе при каскадном
+    удалении и переобработке, поэтому /stats не сканирует таблицы.
+    """
+    c.execute("""
+    CREATE TABLE counters (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    """)
+
+    by_table = {}
+    for name, table, column in COUNTERS:
+        by_table.setdefault(table, []).append((name, column))
+
+    for table, counters in by_table.items():
+        inserted = "".join(_counter_upsert(n, _counter_key(col, "new"), 1) for n, col in counters)
+        deleted = "".join(_counter_upsert(n, _counter_key(col, "old"), -1) for n, col in counters)
+        c.execute(f"CREATE TRIGGER {table}_counters_ai AFTER INSERT ON {table} BEGIN {inserted} END")
+        c.execute(f"CREATE TRIGGER {table}_counters_ad AFTER DELETE ON {table} BEGIN {deleted} END")
+        for name, column in counters:
+            if column is None:
+                continue
+            c.execute(f"""
+                CREATE TRIGGER {table}_counters_au_{column} AFTER UPDATE OF {column} ON {table}
+                WHEN old.{column} IS NOT new.{column} BEGIN
+                    {_counter_upsert(name, _counter_key(column, "old"), -1)}
+                    {_counter_upsert(name, _counter_key(column, "new"), 1)}
+                END
+            """)
+
+    # существующие данные
+    for name, table, column in COUNTERS:
+        key = "''" if column is None else f"COALESCE({column}, '')"
+        c.execute(f"""
+            INSERT INTO counters(name, key, value)
+            SELECT '{name}', {key}, COUNT(*) FROM {table} GROUP BY 2
         """)
 
-        # Отношения
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS relations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id INTEGER,
-            sentence_id INTEGER,
-            subj TEXT,
-            pred TEXT,
-            obj TEXT,
-            FOREIGN KEY (document_id) REFERENCES documents(id),
-            FOREIGN KEY (sentence_id) REFERENCES sentences(id)
+
+def normalize_entity(text):
+    """Ключ канонической сущности: регистр и пробелы не различаются."""
+    return " ".join((text or "").split()).casefold()
+
+
+def _surface(text, canonical):
+    """Текст упоминания для mentions.text: NULL, если совпадает с каноническим."""
+    return None if text == canonical else text
+
+
+def _migration_entity_dict(c):
+    """
+    Словарь канонических сущностей entity_dict: (нормализованный текст,
+    метка) -> id, строка хранится один раз на корпус. Упоминания (таблица
+    entities переименована в mentions) ссылаются на словарь через entity_id
+    вместо собственной метки; собственный text остаётся только у упоминаний,
+    написанных иначе, чем каноническая форма (иначе NULL). Внешние ключи
+    relations переходят на mentions при переименовании. entities —
+    представление с прежними столбцами (текст — как в предложении), поэтому
+    граф и экспорт читают его как раньше. Полнотекстовый поиск сущностей —
+    по словарю. Записи словаря без упоминаний удаляются триггером.
+    """
+    c.connection.create_function("kb_normalize_entity", 1, normalize_entity, deterministic=True)
+
+    c.execute("""
+    CREATE TABLE entity_dict (
+        id INTEGER PRIMARY KEY,
+        norm TEXT NOT NULL,
+        label TEXT NOT NULL,
+        text TEXT NOT NULL,
+        mention_count INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (norm, label)
+    )
+    """)
+    # каноническая форма — первое по id упоминание
+    c.execute("""
+        INSERT OR IGNORE INTO entity_dict(norm, label, text)
+        SELECT kb_normalize_entity(text), COALESCE(label, ''), COALESCE(text, '')
+        FROM entities ORDER BY id
+    """)
+    c.execute("ALTER TABLE entities ADD COLUMN entity_id INTEGER REFERENCES entity_dict(id)")
+    c.execute("""
+        UPDATE entities SET entity_id = (
+            SELECT d.id FROM entity_dict d
+            WHERE d.norm = kb_normalize_entity(entities.text)
+              AND d.label = COALESCE(entities.label, '')
+        )
+    """)
+    c.execute("CREATE INDEX idx_mentions_entity ON entities(entity_id, document_id)")
+    c.execute("""
+        UPDATE entities SET text = NULL
+        WHERE text = (SELECT d.text FROM entity_dict d WHERE d.id = entities.entity_id)
+    """)
+    c.execute("""
+        UPDATE entity_dict SET mention_count = (
+            SELECT COUNT(*) FROM entities WHERE entity_id = entity_dict.id
+        )
+    """)
+
+    # label и индексы/FTS/триггеры счётчиков по text/label уходят из таблицы
+    for trigger in ("entities_fts_ai", "entities_fts_ad", "entities_fts_au",
+                    "entities_counters_ai", "entities_counters_ad", "entities_counters_au_label"):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    c.execute("DROP TABLE IF EXISTS entities_fts")
+    c.execute("DROP INDEX IF EXISTS idx_entities_doc_text")
+    c.execute("DROP INDEX IF EXISTS idx_entities_text")
+    c.execute("ALTER TABLE entities DROP COLUMN label")
+    c.execute("ALTER TABLE entities RENAME TO mentions")
+
+    c.execute("""
+    CREATE VIEW entities AS
+    SELECT m.id, m.document_id, m.sentence_id, COALESCE(m.text, d.text) AS text,
+           NULLIF(d.label, '') AS label,
+           m.start_char, m.end_char, m.doc_start, m.doc_end, m.entity_id
+    FROM mentions m
+    JOIN entity_dict d ON d.id = m.entity_id
+    """)
+
+    c.execute("""
+        CREATE VIRTUAL TABLE entity_dict_fts USING fts5(
+            text,
+            content='entity_dict',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
         )
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entity_dict_ai AFTER INSERT ON entity_dict BEGIN
+            INSERT INTO entity_dict_fts(rowid, text) VALUES (new.id, new.text);
+            {_counter_upsert("canonical_entities", "''", 1)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER entity_dict_ad AFTER DELETE ON entity_dict BEGIN
+            INSERT INTO entity_dict_fts(entity_dict_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            {_counter_upsert("canonical_entities", "''", -1)}
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER entity_dict_au AFTER UPDATE OF text ON entity_dict BEGIN
+            INSERT INTO entity_dict_fts(entity_dict_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO entity_dict_fts(rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+    c.execute("INSERT INTO entity_dict_fts(entity_dict_fts) VALUES ('rebuild')")
+
+    # счётчики упоминаний; метка берётся из словаря до удаления его записи
+    label = "(SELECT label FROM entity_dict WHERE id = {row}.entity_id)"
+    c.execute(f"""
+        CREATE TRIGGER mentions_ai AFTER INSERT ON mentions BEGIN
+            UPDATE entity_dict SET mention_count = mention_count + 1 WHERE id = new.entity_id;
+            {_counter_upsert("entities", "''", 1)}
+            {_counter_upsert("entity_label", label.format(row="new"), 1)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER mentions_ad AFTER DELETE ON mentions BEGIN
+            {_counter_upsert("entities", "''", -1)}
+            {_counter_upsert("entity_label", label.format(row="old"), -1)}
+            UPDATE entity_dict SET mention_count = mention_count - 1 WHERE id = old.entity_id;
+            DELETE FROM entity_dict WHERE id = old.entity_id AND mention_count <= 0;
+        END
+    """)
+    c.execute("""
+        INSERT INTO counters(name, key, value)
+        SELECT 'canonical_entities', '', COUNT(*) FROM entity_dict
+    """)
+
+
+def _edge_upsert(row, delta):
+    """SQL для триггера: вес ребра отношения row (new/old) += delta."""
+    return f"""
+        INSERT INTO entity_edges(src, dst, pred, weight)
+        SELECT {row}.subj_canonical_id, {row}.obj_canonical_id, COALESCE({row}.pred, ''), {delta}
+        WHERE {row}.subj_canonical_id IS NOT NULL AND {row}.obj_canonical_id IS NOT NULL
+          AND {row}.subj_canonical_id != {row}.obj_canonical_id
+        ON CONFLICT(src, dst, pred) DO UPDATE SET weight = weight + excluded.weight;"""
+
+
+def _migration_entity_edges(c):
+    """
+    Индекс смежности корпуса entity_edges: ребро субъект -> объект между
+    каноническими сущностями (entity_dict) с предикатом и весом — числом
+    отношений во всех документах. relations хранят канонические id концов
+    (subj/obj_canonical_id), поэтому триггеры обновляют вес и при каскадном
+    удалении, когда упоминаний уже нет. Рёбра с нулевым весом удаляются.
+    Окрестность сущности (/neighborhood) читается по индексам src и dst.
+    """
+    c.execute("ALTER TABLE relations ADD COLUMN subj_canonical_id INTEGER")
+    c.execute("ALTER TABLE relations ADD COLUMN obj_canonical_id INTEGER")
+    for column, mention in (("subj_canonical_id", "subj_entity_id"), ("obj_canonical_id", "obj_entity_id")):
+        c.execute(f"""
+            UPDATE relations SET {column} = (
+                SELECT entity_id FROM mentions WHERE id = relations.{mention}
+            )
+            WHERE {mention} IS NOT NULL
         """)
 
-        self.conn.commit()
+    c.execute("""
+    CREATE TABLE entity_edges (
+        src INTEGER NOT NULL,
+        dst INTEGER NOT NULL,
+        pred TEXT NOT NULL,
+        weight INTEGER NOT NULL,
+        PRIMARY KEY (src, dst, pred)
+    ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX idx_entity_edges_dst ON entity_edges(dst, src)")
+
+    c.execute(f"""
+        CREATE TRIGGER relations_edges_ai AFTER INSERT ON relations BEGIN
+            {_edge_upsert("new", 1)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER relations_edges_ad AFTER DELETE ON relations BEGIN
+            {_edge_upsert("old", -1)}
+            DELETE FROM entity_edges
+            WHERE src = old.subj_canonical_id AND dst = old.obj_canonical_id
+              AND pred = COALESCE(old.pred, '') AND weight <= 0;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER relations_edges_au
+        AFTER UPDATE OF subj_canonical_id, obj_canonical_id, pred ON relations BEGIN
+            {_edge_upsert("old", -1)}
+            DELETE FROM entity_edges
+            WHERE src = old.subj_canonical_id AND dst = old.obj_canonical_id
+              AND pred = COALESCE(old.pred, '') AND weight <= 0;
+            {_edge_upsert("new", 1)}
+        END
+    """)
+
+    c.execute("""
+        INSERT INTO entity_edges(src, dst, pred, weight)
+        SELECT subj_canonical_id, obj_canonical_id, COALESCE(pred, ''), COUNT(*)
+        FROM relations
+        WHERE subj_canonical_id IS NOT NULL AND obj_canonical_id IS NOT NULL
+          AND subj_canonical_id != obj_canonical_id
+        GROUP BY 1, 2, 3
+    """)
+
+
+def _migration_pending_writes(c):
+    """
+    documents.pending_sentence_id — id первого предложения незавершённой
+    записи документа (write_document пишет пакетами). Пока запись идёт,
+    он выставлен; если процесс упал посреди записи, по нему удаляются
+    записанные пакеты (recover_partial_writes, следующая запись документа).
+    """
+    c.execute("ALTER TABLE documents ADD COLUMN pending_sentence_id INTEGER")
+
+
+MIGRATIONS = [
+    _migration_base,
+    _migration_cascade_indexes,
+    _migration_relation_entities,
+    _migration_fts,
+    _migration_jobs,
+    _migration_document_offsets,
+    _migration_document_timings,
+    _migration_counters,
+    _migration_entity_dict,
+    _migration_entity_edges,
+    _migration_pending_writes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+FTS_TOKEN = re.compile(r"\w+")
+
+
+def fts_query(q):
+    """
+    Строит запрос FTS5 из пользовательской строки: текст в кавычках ищется
+    как фраза, иначе все слова должны встречаться (по префиксу).
+    Возвращает None, если в запросе нет слов.
+    """
+    q = (q or "").strip()
+    tokens = FTS_TOKEN.findall(q)
+    if not tokens:
+        return None
+    if len(q) > 1 and q.startswith('"') and q.endswith('"'):
+        return '"' + " ".join(tokens) + '"'
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+# все счётчики таблицы counters (canonical_entities — из _migration_entity_dict)
+CORPUS_COUNTERS = COUNTERS + (("canonical_entities", "entity_dict", None),)
+
+
+def read_counters(conn, top=None):
+    """
+    Счётчики корпуса (CORPUS_COUNTERS): {имя: число} для счётчиков без
+    разбивки, {имя: {ключ: число}} для разбивок; в разбивке — top самых
+    частых ключей.
+    """
+    result = {}
+    for name, _, column in CORPUS_COUNTERS:
+        if column is None:
+            row = conn.execute(
+                "SELECT value FROM counters WHERE name=? AND key=''", (name,)
+            ).fetchone()
+            result[name] = row[0] if row else 0
+            continue
+        limit = "LIMIT ?" if top is not None else ""
+        params = (name, top) if top is not None else (name,)
+        rows = conn.execute(f"""
+            SELECT key, value FROM counters
+            WHERE name=? AND value > 0
+            ORDER BY value DESC, key
+            {limit}
+        """, params)
+        result[name] = {key: value for key, value in rows}
+    return result
+
+
+def _frontier_edges(conn, frontier, within, min_weight, pred, limit):
+    """
+    Рёбра entity_edges с концом из frontier (каждое по одному разу),
+    по убыванию веса; within — другой конец только из этого списка.
+    Списки id передаются как JSON (json_each), без ограничения числа параметров.
+    """
+    cond = "weight >= ?"
+    cond_params = [min_weight]
+    if pred is not None:
+        cond += " AND pred = ?"
+        cond_params.append(pred)
+    ids = json.dumps(frontier)
+    out_within = in_within = ""
+    within_params = []
+    if within is not None:
+        out_within = "AND dst IN (SELECT value FROM json_each(?))"
+        in_within = "AND src IN (SELECT value FROM json_each(?))"
+        within_params = [json.dumps(within)]
+
+    return conn.execute(f"""
+        SELECT src, dst, pred, weight FROM entity_edges
+        WHERE src IN (SELECT value FROM json_each(?)) {out_within} AND {cond}
+        UNION ALL
+        SELECT src, dst, pred, weight FROM entity_edges
+        WHERE dst IN (SELECT value FROM json_each(?)) {in_within} AND {cond}
+          AND src NOT IN (SELECT value FROM json_each(?))
+        ORDER BY weight DESC
+        LIMIT ?
+    """, (ids, *within_params, *cond_params,
+          ids, *within_params, *cond_params, ids, limit)).fetchall()
+
+
+def neighborhood(conn, seeds, hops=1, max_nodes=200, max_edges=1000, min_weight=1, pred=None):
+    """
+    k-hop окрестность канонических сущностей seeds по индексу entity_edges,
+    без учёта направления рёбер. На каждом шаге соседи добавляются по
+    убыванию веса рёбер, пока узлов не больше max_nodes; в ответ попадают
+    рёбра между выбранными узлами, не больше max_edges.
+    Возвращает (nodes {id: шаг}, edges [(src, dst, pred, weight)], truncated).
+    """
+    nodes = {node: 0 for node in seeds}
+    edges = {}
+    truncated = False
+    frontier = list(nodes)
+
+    for hop in range(1, hops + 2):
+        if not frontier or len(edges) >= max_edges:
+            break
+        # после последнего шага — только рёбра между уже выбранными узлами
+        closing = hop > hops
+        budget = max_edges - len(edges) + (0 if closing else max_nodes - len(nodes))
+        rows = _frontier_edges(
+            conn, frontier, list(nodes) if closing else None, min_weight, pred, budget + 1
+        )
+        if len(rows) > budget:
+            truncated = True
+
+        next_frontier = []
+        for src, dst, edge_pred, weight in rows:
+            if len(edges) >= max_edges:
+                truncated = True
+                break
+            new = [node for node in (src, dst) if node not in nodes]
+            if len(nodes) + len(new) > max_nodes:
+                truncated = True
+                continue
+            for node in new:
+                nodes[node] = hop
+                next_frontier.append(node)
+            edges[(src, dst, edge_pred)] = weight
+        frontier = next_frontier if not closing else []
+
+    return nodes, [(*key, weight) for key, weight in edges.items()], truncated
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _match_entity(text, start, end, sent_ents, doc_index):
+    """
+    Подбирает сущность для субъекта/объекта отношения: сначала по
+    пересечению символьных смещений внутри предложения (наибольшее
+    пересечение), затем по тексту в предложении, затем по тексту
+    в уже записанной части документа.
+    sent_ents — [(entity_id, ent)], doc_index — casefold(text) -> entity_id.
+    """
+    if start is not None and end is not None:
+        best = None
+        best_overlap = 0
+        for local_id, e in sent_ents:
+            if e.get("start_char") is None or e.get("end_char") is None:
+                continue
+            overlap = min(end, e["end_char"]) - max(start, e["start_char"])
+            if overlap > best_overlap:
+                best, best_overlap = local_id, overlap
+        if best is not None:
+            return best
+
+    key = text.casefold()
+    for local_id, e in sent_ents:
+        if e["text"].casefold() == key:
+            return local_id
+    return doc_index.get(key)
+
+
+class Storage:
+    def __init__(self, db_path="out.sqlite", conn=None):
+        """
+        conn — чужое соединение с уже открытой транзакцией (DbWriter):
+        методы пишут в неё, не фиксируя, а close его не закрывает.
+        """
+        self.db_path = db_path
+        self.conn = conn
+        self._owns_conn = conn is None
+        self.jsonld = JsonLdCache(jsonld_cache_dir(db_path))
+        # только файлы кэша графа: записи удаляются при изменении документа
+        self.graph_cache = GraphCache(graph_cache_dir(db_path), memory_bytes=0)
+
+    def connect(self):
+        """Открывает соединение без создания схемы (схема уже инициализирована)."""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+            for pragma in PRAGMAS:
+                self.conn.execute(pragma)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            if self._owns_conn:
+                self.conn.close()
+            self.conn = None
+
+    def _commit(self):
+        if self._owns_conn:
+            self.conn.commit()
+
+    def init_db(self):
+        """Создаёт схему или обновляет существующую БД до SCHEMA_VERSION."""
+        self.connect()
+        c = self.conn.cursor()
+
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # при пересборке таблиц внешние ключи должны быть выключены;
+            # PRAGMA foreign_keys не действует внутри транзакции
+            c.execute("PRAGMA foreign_keys=OFF")
+            for number in range(version + 1, SCHEMA_VERSION + 1):
+                with self.conn:
+                    c.execute("BEGIN")
+                    MIGRATIONS[number - 1](c)
+                    c.execute(f"PRAGMA user_version={number}")
+                log(f"Миграция БД {number} применена")
+            c.execute("PRAGMA foreign_keys=ON")
+
         log("БД инициализирована.")
 
     # -----------------------------
@@ -82,13 +831,13 @@ class Storage:
             VALUES (?, ?, 'processing')
         """, (filename, now))
 
-        self.conn.commit()
+        self._commit()
         return c.lastrowid
 
     def update_document_status(self, doc_id, status):
         c = self.conn.cursor()
         c.execute("UPDATE documents SET status=? WHERE id=?", (status, doc_id))
-        self.conn.commit()
+        self._commit()
 
     def update_counts(self, doc_id, entities, sentences):
         c = self.conn.cursor()
@@ -97,7 +846,14 @@ class Storage:
             SET entities_count=?, sentences_count=?
             WHERE id=?
         """, (entities, sentences, doc_id))
-        self.conn.commit()
+        self._commit()
+
+    def set_document_timings(self, doc_id, timings):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE documents SET timings=? WHERE id=?",
+                (json.dumps(timings) if timings is not None else None, doc_id)
+            )
 
     def get_documents(self):
         c = self.conn.cursor()
@@ -108,39 +864,274 @@ class Storage:
         return c.fetchall()
 
     def delete_document(self, doc_id):
+        # предложения, сущности, отношения и файлы удаляются каскадно
         c = self.conn.cursor()
-        c.execute("DELETE FROM entities WHERE document_id=?", (doc_id,))
-        c.execute("DELETE FROM relations WHERE document_id=?", (doc_id,))
-        c.execute("DELETE FROM sentences WHERE document_id=?", (doc_id,))
         c.execute("DELETE FROM documents WHERE id=?", (doc_id,))
-        self.conn.commit()
+        self._commit()
+        self.jsonld.invalidate(doc_id)
+        self.graph_cache.invalidate(doc_id)
 
     # -----------------------------
-    # SENTENCES / ENTITIES / RELATIONS
+    # FILES MANIFEST
     # -----------------------------
-    def add_sentence(self, doc_id, text):
+    def get_file(self, path):
         c = self.conn.cursor()
-        c.execute("INSERT INTO sentences(document_id, text) VALUES (?, ?)",
-                  (doc_id, text))
-        self.conn.commit()
-        return c.lastrowid
+        c.execute("""
+            SELECT path, size, mtime_ns, sha256, document_id
+            FROM files WHERE path=?
+        """, (path,))
+        return c.fetchone()
 
-    def add_entity(self, doc_id, sentence_id, text, label, start_char=None, end_char=None):
+    def find_file_by_hash(self, sha256):
+        """Ищет уже обработанный файл с тем же содержимым."""
         c = self.conn.cursor()
         c.execute("""
-            INSERT INTO entities(document_id, sentence_id, text, label, start_char, end_char)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (doc_id, sentence_id, text, label, start_char, end_char))
+            SELECT f.path, f.size, f.mtime_ns, f.sha256, f.document_id
+            FROM files f
+            JOIN documents d ON d.id = f.document_id
+            WHERE f.sha256=? AND d.status != 'error'
+            LIMIT 1
+        """, (sha256,))
+        return c.fetchone()
 
-        self.conn.commit()
+    def count_linked_files(self, doc_id, exclude_path):
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM files WHERE document_id=? AND path != ?",
+                  (doc_id, exclude_path))
+        return c.fetchone()[0]
 
-    def add_relation(self, doc_id, sentence_id, subj, pred, obj):
+    def upsert_file(self, path, size, mtime_ns, sha256, doc_id):
         c = self.conn.cursor()
         c.execute("""
-            INSERT INTO relations(document_id, sentence_id, subj, pred, obj)
+            INSERT INTO files(path, size, mtime_ns, sha256, document_id)
             VALUES (?, ?, ?, ?, ?)
-        """, (doc_id, sentence_id, subj, pred, obj))
-        self.conn.commit()
+            ON CONFLICT(path) DO UPDATE SET
+                size=excluded.size,
+                mtime_ns=excluded.mtime_ns,
+                sha256=excluded.sha256,
+                document_id=excluded.document_id
+        """, (path, size, mtime_ns, sha256, doc_id))
+        self._commit()
+
+    # -----------------------------
+    # SENTENCES / ENTITIES / RELATIONS
+    # -----------------------------
+    def write_document(self, doc_id, results, batch_size=WRITE_BATCH_SIZE):
+        """
+        Записывает извлечённые данные документа пакетами по batch_size предложений.
+
+        results — итерируемое (sentence_text, ents, relations) в порядке предложений;
+        оно читается по мере записи, поэтому первые предложения попадают в БД,
+        пока следующие ещё извлекаются, а в памяти держится один пакет.
+        Каждый пакет — короткая транзакция: блокировка записи не держится
+        во время инференса. Это сознательно ослабляет атомарность записи
+        документа одной транзакцией: пока запись идёт, читатели видят новые
+        пакеты рядом со старыми данными. Старые данные документа удаляются,
+        а статус 'completed' выставляется одной завершающей транзакцией.
+        При сбое записанные пакеты удаляются и документ остаётся в прежнем
+        состоянии; если процесс упал посреди записи, пакеты находятся по
+        documents.pending_sentence_id и удаляются при следующей записи
+        документа или recover_partial_writes.
+        Возвращает (sentence_count, entity_count).
+        """
+        first_id = None
+        sentence_count = 0
+        entity_count = 0
+        # casefold(text) -> id сущности: уже записанные сущности документа
+        doc_index = {}
+
+        self._discard_pending(doc_id)
+        try:
+            for batch in _batches(results, batch_size):
+                with metrics.timer("kb_db_write_batch_seconds"):
+                    first, ents = self._write_batch(doc_id, batch, doc_index, first_id is None)
+                if first_id is None:
+                    first_id = first
+                sentence_count += len(batch)
+                entity_count += ents
+        except BaseException:
+            if first_id is not None:
+                self.conn.rollback()
+                self._discard_pending(doc_id)
+            raise
+
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+
+            # id новых предложений больше старых: старые данные документа — всё,
+            # что ниже first_id (сущности и отношения удаляются каскадно)
+            if first_id is None:
+                c.execute("DELETE FROM sentences WHERE document_id=?", (doc_id,))
+            else:
+                c.execute("DELETE FROM sentences WHERE document_id=? AND id<?", (doc_id, first_id))
+
+            c.execute("""
+                UPDATE documents
+                SET entities_count=?, sentences_count=?, status='completed',
+                    pending_sentence_id=NULL
+                WHERE id=?
+            """, (entity_count, sentence_count, doc_id))
+
+            self.jsonld.invalidate(doc_id)
+            self.graph_cache.invalidate(doc_id)
+
+        # JSON-LD фрагмент документа строится один раз, после коммита
+        self.jsonld.build(self.conn, doc_id)
+
+        metrics.inc("kb_sentences_total", sentence_count)
+        metrics.inc("kb_entities_total", entity_count)
+        return sentence_count, entity_count
+
+    def _write_batch(self, doc_id, batch, doc_index, first=False):
+        """
+        Пакет предложений с сущностями и отношениями; first — первый пакет
+        записи (отмечается в documents.pending_sentence_id).
+        Возвращает (id первого предложения, число сущностей).
+        """
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+
+            # id назначаются заранее, чтобы вставлять сущности и отношения
+            # через executemany без lastrowid
+            base = self._next_id(c, "sentences")
+            ent_id = self._next_id(c, "mentions")
+
+            sentences = []
+            entities = []
+            relations = []
+            # (норма, метка) -> текст первого упоминания в пакете
+            entity_keys = {}
+            for i, (sent, ents, rels) in enumerate(batch):
+                sid = base + i
+                # смещения в документе есть у предложений из TextPreprocessor
+                to_source = getattr(sent, "to_source", None)
+                sentences.append((sid, doc_id, str(sent),
+                                  getattr(sent, "start", None), getattr(sent, "end", None)))
+                sent_ents = []
+                for e in ents:
+                    start, end = e.get("start_char"), e.get("end_char")
+                    doc_start = doc_end = None
+                    if to_source is not None and start is not None and end is not None:
+                        doc_start = to_source(start)
+                        doc_end = to_source(end - 1) + 1 if end > start else doc_start
+                    key = (normalize_entity(e["text"]), e["label"] or "")
+                    entity_keys.setdefault(key, e["text"])
+                    entities.append((ent_id, doc_id, sid, key, e["text"],
+                                     start, end, doc_start, doc_end))
+                    sent_ents.append((ent_id, e))
+                    doc_index.setdefault(e["text"].casefold(), ent_id)
+                    ent_id += 1
+                for r in rels:
+                    relations.append((sid, r, sent_ents))
+
+            # субъект и объект отношения связываются с сущностями один раз,
+            # при записи, а не при каждом построении графа
+            relation_rows = []
+            for sid, r, sent_ents in relations:
+                subj_id = _match_entity(r["subj"], r.get("subj_start"), r.get("subj_end"), sent_ents, doc_index)
+                obj_id = _match_entity(r["obj"], r.get("obj_start"), r.get("obj_end"), sent_ents, doc_index)
+                relation_rows.append((doc_id, sid, r["subj"], r["pred"], r["obj"], subj_id, obj_id))
+
+            c.executemany("""
+                INSERT INTO sentences(id, document_id, text, doc_start, doc_end)
+                VALUES (?, ?, ?, ?, ?)
+            """, sentences)
+            if first:
+                c.execute("UPDATE documents SET pending_sentence_id=? WHERE id=?", (base, doc_id))
+            # строки сущностей — в словарь (один раз на корпус), в mentions —
+            # ссылки; текст упоминания — только если он отличается от канонического
+            entity_ids = self._intern_entities(c, entity_keys)
+            mention_rows = []
+            for row in entities:
+                entity_id, canonical = entity_ids[row[3]]
+                mention_rows.append((*row[:3], entity_id, _surface(row[4], canonical), *row[5:]))
+            c.executemany("""
+                INSERT INTO mentions(id, document_id, sentence_id, entity_id, text,
+                                     start_char, end_char, doc_start, doc_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, mention_rows)
+            # канонические id концов — для индекса смежности entity_edges;
+            # упоминания могут быть из предыдущих пакетов, поэтому из БД
+            c.executemany("""
+                INSERT INTO relations(document_id, sentence_id, subj, pred, obj,
+                                      subj_entity_id, obj_entity_id,
+                                      subj_canonical_id, obj_canonical_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?,
+                        (SELECT entity_id FROM mentions WHERE id = ?),
+                        (SELECT entity_id FROM mentions WHERE id = ?))
+            """, [(*row, row[5], row[6]) for row in relation_rows])
+        return base, len(entities)
+
+    def _discard_pending(self, doc_id):
+        """Удаляет пакеты незавершённой записи документа, если они есть."""
+        row = self.conn.execute(
+            "SELECT pending_sentence_id FROM documents WHERE id=?", (doc_id,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("DELETE FROM sentences WHERE document_id=? AND id>=?", (doc_id, row[0]))
+            c.execute("UPDATE documents SET pending_sentence_id=NULL WHERE id=?", (doc_id,))
+
+    def recover_partial_writes(self):
+        """
+        Удаляет пакеты записей, прерванных остановкой процесса, и помечает
+        такие документы 'error', если для них нет задания в очереди.
+        Вызывается при старте, как JobQueue.recover: другие процессы
+        в это время документы не пишут. Возвращает число документов.
+        """
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            rows = c.execute("""
+                SELECT id, pending_sentence_id FROM documents
+                WHERE pending_sentence_id IS NOT NULL
+            """).fetchall()
+            for doc_id, first_id in rows:
+                c.execute("DELETE FROM sentences WHERE document_id=? AND id>=?", (doc_id, first_id))
+                c.execute("""
+                    UPDATE documents SET pending_sentence_id=NULL,
+                        status = CASE WHEN EXISTS (
+                            SELECT 1 FROM jobs
+                            WHERE document_id = documents.id AND status IN ('queued', 'running')
+                        ) THEN status ELSE 'error' END
+                    WHERE id=?
+                """, (doc_id,))
+        return len(rows)
+
+    @staticmethod
+    def _intern_entities(c, entities):
+        """
+        entities — {(норма, метка): текст}; возвращает {(норма, метка): (id,
+        канонический текст)} записей entity_dict, недостающие добавляются
+        (текст — каноническая форма).
+        """
+        ids = {}
+        for key, text in entities.items():
+            row = c.execute(
+                "SELECT id, text FROM entity_dict WHERE norm=? AND label=?", key
+            ).fetchone()
+            if row is None:
+                c.execute(
+                    "INSERT INTO entity_dict(norm, label, text) VALUES (?, ?, ?)", (*key, text)
+                )
+                ids[key] = (c.lastrowid, text)
+            else:
+                ids[key] = (row[0], row[1])
+        return ids
+
+    @staticmethod
+    def _next_id(c, table):
+        # AUTOINCREMENT не переиспользует id: учитываем и sqlite_sequence
+        c.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,))
+        row = c.fetchone()
+        seq = row[0] if row else 0
+        c.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return max(seq, c.fetchone()[0]) + 1
 
     def get_document_entities(self, doc_id):
         c = self.conn.cursor()
@@ -164,105 +1155,23 @@ class Storage:
     def export_graphml(self, out_path="graph.out.graphml", document_id=None):
         """
         Экспорт графа в GraphML. Если document_id=None — экспортирует весь граф.
+        Файл пишется потоково (export.iter_graphml), память не зависит от размера корпуса.
         """
-        G = nx.DiGraph()
-        c = self.conn.cursor()
-
-        if document_id:
-            doc_filter = "WHERE document_id = ?"
-            params = (document_id,)
-        else:
-            doc_filter = ""
-            params = ()
-
-        # Узлы: предложения
-        c.execute(f"SELECT id, document_id, text FROM sentences {doc_filter}")
-        for sid, docid, text in c.fetchall():
-            G.add_node(
-                f"sent_{sid}",
-                type="sentence",
-                text=text,
-                document_id=docid
-            )
-
-        # Узлы: сущности
-        c.execute(f"SELECT id, document_id, text, label FROM entities {doc_filter}")
-        for eid, docid, text, label in c.fetchall():
-            G.add_node(
-                f"ent_{eid}",
-                type="entity",
-                label=label,
-                text=text,
-                document_id=docid
-            )
-
-        # Узлы: отношения
-        c.execute(f"SELECT id, document_id, subj, pred, obj, sentence_id FROM relations {doc_filter}")
-        for rid, docid, subj, pred, obj, sid in c.fetchall():
-            G.add_node(
-                f"rel_{rid}",
-                type="relation",
-                label=pred,
-                document_id=docid
-            )
-
-            # ищем сущность subj
-            c.execute("SELECT id FROM entities WHERE text=?", (subj,))
-            row_sub = c.fetchone()
-            if row_sub:
-                G.add_edge(f"ent_{row_sub[0]}", f"rel_{rid}", edge_type="subj")
-
-            # ищем сущность obj
-            c.execute("SELECT id FROM entities WHERE text=?", (obj,))
-            row_obj = c.fetchone()
-            if row_obj:
-                G.add_edge(f"rel_{rid}", f"ent_{row_obj[0]}", edge_type="obj")
-
-            # предложение связи
-            G.add_edge(f"sent_{sid}", f"rel_{rid}", edge_type="context")
-
-        nx.write_graphml(G, out_path)
+        with open(out_path, "w", encoding="utf-8") as f:
+            for chunk in iter_graphml(self.conn, document_id):
+                f.write(chunk)
         log(f"GraphML экспортирован: {out_path}")
 
     # -----------------------------
     # EXPORT JSON-LD
     # -----------------------------
     def export_jsonld(self, out_path="graph.out.jsonld", document_id=None):
-        c = self.conn.cursor()
-
-        if document_id:
-            doc_filter = "WHERE document_id = ?"
-            params = (document_id,)
-        else:
-            doc_filter = ""
-            params = ()
-
-        graph = {"@context": {}, "@graph": []}
-
-        # Сущности
-        c.execute(f"SELECT id, text, label, document_id FROM entities {doc_filter}", params)
-        for eid, text, label, docid in c.fetchall():
-            graph["@graph"].append({
-                "@id": f"entity/{eid}",
-                "type": "Entity",
-                "document": docid,
-                "text": text,
-                "label": label,
-            })
-
-        # Отношения
-        c.execute(f"SELECT id, subj, pred, obj, document_id FROM relations {doc_filter}", params)
-        for rid, subj, pred, obj, docid in c.fetchall():
-            graph["@graph"].append({
-                "@id": f"relation/{rid}",
-                "type": "Relation",
-                "document": docid,
-                "subj": subj,
-                "pred": pred,
-                "obj": obj,
-            })
-
+        """
+        Экспорт JSON-LD склейкой закэшированных фрагментов документов
+        (export.JsonLdCache); недостающие фрагменты строятся при экспорте.
+        """
         with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(graph, f, ensure_ascii=False, indent=2)
+            for chunk in self.jsonld.iter_export(self.conn, document_id):
+                f.write(chunk)
 
         log(f"JSON-LD экспортирован: {out_path}")
@@ -0,0 +1,28 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# модули BACK импортируются по имени (storage, worker, ...), как в app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_nlp import StubNLPProcessor  # noqa: E402
+from preprocess import TextPreprocessor  # noqa: E402
+
+
+class TextIngestor:
+    """DocumentIngestor для тестов: файл читается как текст, без PDF и OCR."""
+
+    def iter_file(self, path, progress=None, timings=None):
+        with open(path, encoding="utf-8") as f:
+            yield f.read()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def components():
+    """Компоненты пула воркеров без spaCy: (ingestor, preprocessor, nlp)."""
+    return (TextIngestor(), TextPreprocessor(), StubNLPProcessor())
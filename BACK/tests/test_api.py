@@ -0,0 +1,111 @@
+# tests/test_api.py
+import importlib
+import os
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+TEXT = "Иван Петров встретил Анну Смирнову в Москве. Анна Смирнова живёт в Казани."
+
+
+@pytest.fixture
+def api_env():
+    """Дополнительные переменные окружения app (переопределяется parametrize)."""
+    return {}
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch, components, api_env):
+    # app настраивается переменными окружения при импорте
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "out.sqlite"))
+    monkeypatch.setenv("INPUT_DIR", str(tmp_path / "input_docs"))
+    for name, value in api_env.items():
+        monkeypatch.setenv(name, value)
+    sys.modules.pop("app", None)
+    app = importlib.import_module("app")
+    app.workers._components = lambda: components
+    with TestClient(app.app) as client:
+        yield app, client
+    sys.modules.pop("app", None)
+
+
+def upload(client, name="doc.pdf", data=TEXT.encode("utf-8")):
+    return client.post("/extract", files={"file": (name, data, "application/octet-stream")})
+
+
+def wait_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Задание {job_id} не завершилось за {timeout} с")
+
+
+def test_graph_page_does_not_match_full_graph_etag(api):
+    _, client = api
+    job = upload(client).json()
+    assert wait_job(client, job["jobId"])["status"] == "completed"
+    doc_id = job["documentId"]
+
+    full = client.get(f"/graph/{doc_id}")
+    etag = full.headers["etag"]
+    assert client.get(f"/graph/{doc_id}", headers={"if-none-match": etag}).status_code == 304
+
+    page = client.get(f"/graph/{doc_id}?limit=1", headers={"if-none-match": etag})
+    assert page.status_code == 200
+    assert page.headers["etag"] != etag
+    assert page.json()["next"] is not None
+    assert client.get(f"/graph/{doc_id}?limit=1",
+                      headers={"if-none-match": page.headers["etag"]}).status_code == 304
+
+
+@pytest.mark.parametrize("api_env", [{"MAX_UPLOAD_MB": "1"}])
+def test_oversize_upload_rejected_before_saving(api):
+    app, client = api
+    response = upload(client, data=b"x" * (2 * 1024 * 1024))
+    assert response.status_code == 413
+    # тело не разбиралось: во входном каталоге нет даже временного файла
+    assert not os.path.exists(app.INPUT_DIR) or os.listdir(app.INPUT_DIR) == []
+
+
+def test_unsupported_extension_rejected(api):
+    app, client = api
+    response = upload(client, name="notes.txt")
+    assert response.status_code == 400
+    assert client.get("/documents").json() == []
+    assert not os.path.exists(app.INPUT_DIR) or os.listdir(app.INPUT_DIR) == []
+
+
+@pytest.mark.parametrize("api_env", [{"MAX_QUEUED_JOBS": "1", "EXTRACT_WORKERS": "0"}])
+def test_rejected_upload_file_removed(api):
+    app, client = api
+    first = upload(client)
+    assert first.status_code == 200
+
+    response = upload(client, name="other.pdf", data=b"other content")
+    assert response.status_code == 429
+    # остаётся только файл принятой загрузки
+    assert len(os.listdir(app.INPUT_DIR)) == 1
+
+
+@pytest.mark.parametrize("api_env", [{"EXTRACT_WORKERS": "0"}])
+def test_reprocess_conflicts_with_active_job(api):
+    _, client = api
+    job = upload(client).json()
+
+    response = client.post(f"/reprocess/{job['documentId']}")
+    assert response.status_code == 409
+    assert response.headers["location"] == f"/jobs/{job['jobId']}"
+
+
+def test_ui_export_links_redirect_to_export(api):
+    _, client = api
+    for fmt in ("graphml", "jsonld"):
+        response = client.get(f"/{fmt}", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == f"/export/{fmt}"
+        assert client.get(f"/{fmt}").status_code == 200
@@ -0,0 +1,53 @@
+# tests/test_nlp_cache.py
+from benchmarks.stub_nlp import StubNLPProcessor
+from nlp_cache import CachedNLPProcessor
+
+
+class CountingProcessor(StubNLPProcessor):
+    """StubNLPProcessor, который запоминает, какие предложения ушли в модель."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def process_sentences(self, sents, batch_size=None, n_process=None):
+        sents = list(sents)
+        self.calls.append(sents)
+        return super().process_sentences(sents, batch_size, n_process)
+
+
+def test_repeated_sentences_in_batch_are_parsed_once():
+    processor = CountingProcessor()
+    cached = CachedNLPProcessor(processor)
+    sents = [
+        "Иван Петров работает в Москве.",
+        "Страница 1 из 10.",
+        "Иван Петров работает в Москве.",
+        "Страница 1 из 10.",
+        "Анна Смирнова живёт в Казани.",
+    ]
+
+    results = list(cached.process_sentences(sents))
+
+    assert processor.calls == [[
+        "Иван Петров работает в Москве.",
+        "Страница 1 из 10.",
+        "Анна Смирнова живёт в Казани.",
+    ]]
+    assert results == [processor.process_sentence(s) for s in sents]
+
+    # вторая порция целиком берётся из кэша
+    list(cached.process_sentences(sents))
+    assert len(processor.calls) == 1
+
+
+def test_sentences_differing_in_spacing_are_cached_separately():
+    processor = CountingProcessor()
+    cached = CachedNLPProcessor(processor)
+    sents = ["Иван Петров работает в Москве.", "Иван  Петров работает в  Москве."]
+
+    results = list(cached.process_sentences(sents))
+
+    # смещения сущностей у каждого предложения свои
+    assert results == [processor.process_sentence(s) for s in sents]
+    assert results[0] != results[1]
@@ -0,0 +1,24 @@
+# tests/test_preprocess.py
+from preprocess import TextPreprocessor
+
+
+def sentences(chunks):
+    return [(str(s), s.start, s.end) for s in TextPreprocessor().iter_sentences(chunks)]
+
+
+def test_sentence_spanning_many_chunks():
+    chunks = ["Иван", "Петров", "встретил", "Анну. Потом", "ушёл."]
+    text = "\n".join(chunks)
+    result = sentences(chunks)
+
+    assert [r[0] for r in result] == ["Иван Петров встретил Анну.", "Потом ушёл."]
+    # смещения — в тексте, склеенном через "\n"
+    assert [text[start:end] for _, start, end in result] == [
+        "Иван\nПетров\nвстретил\nАнну.", "Потом\nушёл."
+    ]
+
+
+def test_page_number_in_next_chunk_ends_sentence():
+    # "Page" в конце части, номер страницы — в следующей
+    result = sentences(["Первое предложение.Page", "3 Второе предложение."])
+    assert [r[0] for r in result] == ["Первое предложение.", "Второе предложение."]
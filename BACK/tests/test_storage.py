@@ -0,0 +1,104 @@
+# tests/test_storage.py
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from storage import Storage
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sentences(doc, n):
+    return [(f"{doc} sentence {i}.", [], []) for i in range(n)]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "out.sqlite"))
+    storage.init_db()
+    yield storage
+    storage.close()
+
+
+def crash_while_writing(db_path, doc_id, batches_before_crash):
+    """Запись документа в отдельном процессе, который падает посреди записи."""
+    code = textwrap.dedent(f"""
+        import os
+        from storage import Storage
+
+        def results():
+            for i in range({batches_before_crash * 2} + 1):
+                if i == {batches_before_crash * 2}:
+                    os._exit(1)
+                yield (f"new sentence {{i}}.", [], [])
+
+        storage = Storage({db_path!r})
+        storage.connect()
+        storage.write_document({doc_id}, results(), batch_size=2)
+    """)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BACK_DIR)
+    assert proc.returncode == 1
+
+
+def texts(storage, doc_id):
+    rows = storage.conn.execute(
+        "SELECT text FROM sentences WHERE document_id=? ORDER BY id", (doc_id,)
+    )
+    return [r[0] for r in rows]
+
+
+def test_failed_write_keeps_previous_data(storage):
+    doc_id = storage.add_document("a.txt")
+    storage.write_document(doc_id, sentences("old", 3), batch_size=2)
+
+    def failing():
+        yield from sentences("new", 3)
+        raise RuntimeError("NLP failed")
+
+    with pytest.raises(RuntimeError):
+        storage.write_document(doc_id, failing(), batch_size=2)
+    assert texts(storage, doc_id) == [t for t, _, _ in sentences("old", 3)]
+
+
+def test_crash_mid_write_is_recovered(storage):
+    doc_id = storage.add_document("a.txt")
+    storage.write_document(doc_id, sentences("old", 3), batch_size=2)
+
+    crash_while_writing(storage.db_path, doc_id, batches_before_crash=2)
+    assert len(texts(storage, doc_id)) == 3 + 4
+
+    assert storage.recover_partial_writes() == 1
+    assert texts(storage, doc_id) == [t for t, _, _ in sentences("old", 3)]
+    status = storage.conn.execute("SELECT status FROM documents WHERE id=?", (doc_id,)).fetchone()[0]
+    assert status == "error"
+
+
+def test_rewrite_after_crash_drops_partial_batches(storage):
+    doc_id = storage.add_document("a.txt")
+    crash_while_writing(storage.db_path, doc_id, batches_before_crash=1)
+
+    storage.write_document(doc_id, sentences("new", 1))
+    assert texts(storage, doc_id) == ["new sentence 0."]
+
+
+def test_mentions_keep_surface_text(storage):
+    doc_id = storage.add_document("a.txt")
+    ents = [
+        {"text": "Иван Петров", "label": "PER", "start_char": 0, "end_char": 11},
+        {"text": "ИВАН  ПЕТРОВ", "label": "PER", "start_char": 20, "end_char": 32},
+    ]
+    storage.write_document(doc_id, [("Иван Петров и ИВАН  ПЕТРОВ.", ents, [])])
+
+    rows = storage.conn.execute(
+        "SELECT text, entity_id FROM entities WHERE document_id=? ORDER BY id", (doc_id,)
+    ).fetchall()
+    assert [r[0] for r in rows] == ["Иван Петров", "ИВАН  ПЕТРОВ"]
+    # одна каноническая сущность; текст хранится только у отличающегося упоминания
+    assert rows[0][1] == rows[1][1]
+    stored = storage.conn.execute(
+        "SELECT text FROM mentions WHERE document_id=? ORDER BY id", (doc_id,)
+    ).fetchall()
+    assert stored == [(None,), ("ИВАН  ПЕТРОВ",)]
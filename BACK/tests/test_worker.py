@@ -0,0 +1,130 @@
+# tests/test_worker.py
+import sqlite3
+import time
+
+import pytest
+
+from jobs import QueueFull
+from storage import Storage
+from worker import ExtractionWorkerPool
+
+
+@pytest.fixture
+def pool(tmp_path, components):
+    db_path = str(tmp_path / "out.sqlite")
+    storage = Storage(db_path)
+    storage.init_db()
+    storage.close()
+
+    pool = ExtractionWorkerPool(db_path)
+    pool._components = lambda: components
+    yield pool
+    pool.stop(timeout=5)
+
+
+def wait_job(pool, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = pool.get_job(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Задание {job_id} не завершилось за {timeout} с")
+
+
+def document_status(pool, doc_id):
+    conn = sqlite3.connect(pool.db_path)
+    try:
+        return conn.execute("SELECT status FROM documents WHERE id=?", (doc_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_fast_job_leaves_document_completed(pool, tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("Иван Петров встретил Анну Смирнову в Москве.", encoding="utf-8")
+
+    # воркер успевает завершить задание до того, как submit вернёт управление
+    notify = pool.queue.notify
+
+    def notify_and_wait():
+        notify()
+        conn = sqlite3.connect(pool.db_path)
+        try:
+            while conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]:
+                time.sleep(0.02)
+        finally:
+            conn.close()
+
+    pool.queue.notify = notify_and_wait
+    pool.start()
+
+    job = pool.submit(str(path))
+    assert wait_job(pool, job["id"])["status"] == "completed"
+    assert document_status(pool, job["document_id"]) == "completed"
+
+
+def test_same_content_submitted_concurrently_gives_one_document(pool, tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("Иван Петров встретил Анну Смирнову в Москве.", encoding="utf-8")
+    pool.start()
+
+    # вторая загрузка приходит, пока первая ещё в очереди
+    first = pool.submit(str(path))
+    second = pool.submit(str(path))
+    assert second["duplicate"]
+    assert second["document_id"] == first["document_id"]
+    assert wait_job(pool, first["id"])["status"] == "completed"
+
+
+def test_failed_document_keeps_its_file(pool, components, tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("Иван Петров встретил Анну Смирнову в Москве.", encoding="utf-8")
+
+    def failing_iter_file(path, progress=None, timings=None):
+        raise RuntimeError("boom")
+
+    components[0].iter_file = failing_iter_file
+    pool.start()
+
+    job = pool.submit(str(path))
+    assert wait_job(pool, job["id"])["status"] == "failed"
+
+    conn = sqlite3.connect(pool.db_path)
+    try:
+        row = conn.execute("SELECT document_id FROM files WHERE path=?",
+                           (str(path),)).fetchone()
+    finally:
+        conn.close()
+    assert row == (job["document_id"],)
+
+    # повторная загрузка того же содержимого переобрабатывает тот же документ
+    del components[0].iter_file
+    retry = pool.submit(str(path))
+    assert not retry["duplicate"]
+    assert retry["document_id"] == job["document_id"]
+    assert wait_job(pool, retry["id"])["status"] == "completed"
+
+
+def test_submit_writes_through_writer(pool, tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("Иван Петров встретил Анну Смирнову в Москве.", encoding="utf-8")
+    pool.queue.max_queued = 1
+
+    job = pool.submit(str(path))
+    # вызывающий поток не держит собственного соединения очереди
+    assert getattr(pool.queue._local, "conn", None) is None
+
+    other = tmp_path / "other.txt"
+    other.write_text("Анна Смирнова живёт в Казани.", encoding="utf-8")
+    with pytest.raises(QueueFull):
+        pool.submit(str(other))
+
+    # отказ откатывает всю транзакцию: нового документа нет
+    conn = sqlite3.connect(pool.db_path)
+    try:
+        assert conn.execute("SELECT id FROM documents").fetchall() == [(job["document_id"],)]
+    finally:
+        conn.close()
@@ -0,0 +1,242 @@
+# worker.py
+import os
+import threading
+import metrics
+from db_pool import DbWriter
+from ingest import DocumentIngestor
+from jobs import JobQueue, JobActive, PRIORITY_UPLOAD, PRIORITY_REPROCESS
+from manifest import FileManifest, CHANGED, UNCHANGED, DUPLICATE
+from nlp_model import NLPProcessor
+from nlp_cache import CachedNLPProcessor
+from ocr_cache import DEFAULT_MAX_BYTES
+from preprocess import TextPreprocessor
+from pipeline import process_document
+from storage import Storage
+from utils import log
+
+
+class ExtractionWorkerPool:
+    """
+    Резидентный пул воркеров извлечения знаний.
+
+    Модели spaCy и DocumentIngestor загружаются один раз при старте
+    и переиспользуются всеми заданиями, поэтому задержка обработки
+    документа определяется самим извлечением, а не загрузкой моделей.
+    Задания берутся из персистентной очереди (jobs.JobQueue); число
+    потоков ограничивает число одновременно обрабатываемых документов.
+    Каждый поток держит собственное соединение с SQLite; постановка
+    в очередь идёт через writer (DbWriter API) — вызывающие потоки
+    соединений не открывают.
+    """
+
+    def __init__(self, db_path, workers=1, lang="ru", batch_size=64, n_process=1,
+                 max_queued=100, ocr_workers=None, page_timeout=120,
+                 ocr_cache_path=None, ocr_cache_max_bytes=DEFAULT_MAX_BYTES,
+                 nlp_cache_entries=0, nlp_cache_path=None, writer=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.lang = lang
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.ocr_workers = ocr_workers
+        self.page_timeout = page_timeout
+        self.ocr_cache_path = ocr_cache_path
+        self.ocr_cache_max_bytes = ocr_cache_max_bytes
+        self.nlp_cache_entries = nlp_cache_entries
+        self.nlp_cache_path = nlp_cache_path
+
+        self.queue = JobQueue(db_path, max_queued=max_queued)
+        self._owns_writer = writer is None
+        self.writer = writer or DbWriter(db_path)
+        self._threads = []
+        self._stopping = threading.Event()
+
+        self._ingestor = None
+        self._preproc = None
+        self._nlp = None
+        self._load_lock = threading.Lock()
+
+    # -----------------------------
+    # LIFECYCLE
+    # -----------------------------
+    def start(self):
+        recovered = self.queue.recover()
+        self.queue.close()
+        if recovered:
+            log(f"Прерванные задания возвращены в очередь: {recovered}")
+        storage = Storage(self.db_path)
+        storage.connect()
+        try:
+            partial = storage.recover_partial_writes()
+        finally:
+            storage.close()
+        if partial:
+            log(f"Удалены данные прерванной записи документов: {partial}")
+
+        self._stopping.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"extract-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        log(f"Пул воркеров запущен: workers={self.workers}, lang={self.lang}")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.queue.wakeup()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        if self._ingestor is not None:
+            self._ingestor.close()
+        if isinstance(self._nlp, CachedNLPProcessor):
+            self._nlp.close()
+        if self._owns_writer:
+            self.writer.close()
+        log("Пул воркеров остановлен")
+
+    def _components(self):
+        # компоненты общие для всех потоков и создаются один раз;
+        # модели spaCy NLPProcessor загружает сам, при первом использовании
+        with self._load_lock:
+            if self._nlp is None:
+                self._ingestor = DocumentIngestor(
+                    workers=self.ocr_workers,
+                    page_timeout=self.page_timeout,
+                    cache_path=self.ocr_cache_path,
+                    cache_max_bytes=self.ocr_cache_max_bytes,
+                )
+                self._preproc = TextPreprocessor()
+                self._nlp = NLPProcessor(
+                    lang_preference=self.lang,
+                    batch_size=self.batch_size,
+                    n_process=self.n_process,
+                )
+                if self.nlp_cache_entries:
+                    self._nlp = CachedNLPProcessor(
+                        self._nlp,
+                        path=self.nlp_cache_path,
+                        memory_entries=self.nlp_cache_entries,
+                    )
+        return self._ingestor, self._preproc, self._nlp
+
+    # -----------------------------
+    # JOBS
+    # -----------------------------
+    def submit(self, path, filename=None, doc_id=None, sha256=None):
+        """
+        Ставит файл в очередь на обработку и сразу возвращает задание.
+        Если doc_id передан — документ переобрабатывается под тем же id
+        (jobs.JobActive, если у него уже есть задание в очереди или в работе).
+        Файл, содержимое которого уже извлечено или обрабатывается (манифест),
+        не обрабатывается повторно: задание сразу завершается со ссылкой на
+        существующий документ; документ, обработка которого не удалась,
+        обрабатывается заново. Строка манифеста записывается при постановке
+        в очередь, поэтому путь к файлу известен и для незавершённых заданий.
+        Проверка манифеста, создание документа и постановка в очередь —
+        одна транзакция writer: одновременные загрузки одного содержимого
+        дают один документ, а отказ (jobs.QueueFull, если очередь
+        заполнена) не оставляет документа без задания.
+        sha256 — уже посчитанный хэш содержимого (файл не перечитывается).
+        """
+        filename = filename or os.path.basename(path)
+        kind = "upload" if doc_id is None else "reprocess"
+        priority = PRIORITY_UPLOAD if doc_id is None else PRIORITY_REPROCESS
+
+        with self.writer.transaction() as conn:
+            storage = Storage(self.db_path, conn=conn)
+            job = self._submit(storage, kind, priority, path, filename, doc_id, sha256)
+
+        if not job["duplicate"]:
+            # воркер будится после фиксации: иначе он не увидит задание
+            self.queue.notify()
+            log(f"Задание {job['id']} поставлено в очередь: "
+                f"doc_id={job['document_id']}, file={filename}")
+        return job
+
+    def _submit(self, storage, kind, priority, path, filename, doc_id, sha256):
+        info = None
+        new_doc = False
+        manifest = FileManifest(storage)
+
+        if doc_id is None:
+            state, info = manifest.check(path, sha256=sha256)
+            existing = None
+            if state in (UNCHANGED, DUPLICATE):
+                existing = storage.conn.execute(
+                    "SELECT status FROM documents WHERE id=?", (info["document_id"],)
+                ).fetchone()
+                if existing is not None and existing[0] != "error":
+                    log(f"Содержимое {filename} уже обработано: doc_id={info['document_id']}")
+                    return self.queue.record_completed(
+                        kind, info["document_id"], path, filename, duplicate=True,
+                        conn=storage.conn
+                    )
+            if state == CHANGED or existing is not None:
+                doc_id = info["document_id"]
+            else:
+                doc_id = storage.add_document(filename)
+                new_doc = True
+
+        # статус выставляется в той же транзакции, что и задание: воркер
+        # может завершить его раньше, чем submit вернёт управление.
+        # Второе задание того же документа не ставится: два воркера
+        # одновременно удаляли бы и переписывали одни и те же данные
+        if not new_doc:
+            active = self.queue.active(doc_id, conn=storage.conn)
+            if active is not None:
+                raise JobActive(active)
+            storage.update_document_status(doc_id, "processing")
+        job = self.queue.enqueue(kind, doc_id, path, filename, priority,
+                                 file_info=info, conn=storage.conn)
+        if info is not None:
+            manifest.record(info, doc_id=doc_id)
+        return job
+
+    def nlp_cache_stats(self):
+        if isinstance(self._nlp, CachedNLPProcessor):
+            return self._nlp.stats()
+        return None
+
+    def get_job(self, job_id, conn=None):
+        return self.queue.get(job_id, conn=conn)
+
+    def _run(self):
+        storage = Storage(self.db_path)
+        storage.connect()
+
+        try:
+            # прогрев: модель языка по умолчанию грузится в фоне,
+            # до первого задания, а не на старте API
+            _, _, nlp = self._components()
+            nlp.preload()
+        except Exception as e:
+            log(f"Не удалось загрузить NLP-модель: {e}")
+
+        while not self._stopping.is_set():
+            job = self.queue.claim(timeout=1.0)
+            if job is not None:
+                self._process(job, storage)
+
+        storage.close()
+        self.queue.close()
+
+    def _process(self, job, storage):
+        job_id = job["id"]
+        doc_id = job["document_id"]
+
+        def progress(**fields):
+            self.queue.progress(job_id, **fields)
+
+        try:
+            ingestor, preproc, nlp = self._components()
+            timings = metrics.stage_timings()
+            chunks = ingestor.iter_file(job["path"], progress=progress, timings=timings)
+            process_document(doc_id, chunks, preproc, nlp, storage,
+                             progress=progress, timings=timings)
+            self.queue.finish(job_id, "completed")
+        except Exception as e:
+            log(f"Ошибка обработки задания {job_id} ({job['path']}): {e}")
+            metrics.inc("kb_documents_total", status="error")
+            storage.conn.rollback()
+            storage.update_document_status(doc_id, "error")
+            self.queue.finish(job_id, "failed", error=str(e))